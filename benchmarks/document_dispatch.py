@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of per-call overhead of StorageDocument methods.
+
+Compares the bound-method StorageDocument against the previous dynamic
+`__getattr__` dispatch on a MemoryStorage, so storage I/O does not hide the
+dispatch cost.
+
+    python -m benchmarks.document_dispatch
+"""
+
+import timeit
+from functools import partial
+
+from expkit.storage import MemoryStorage
+
+
+class DynamicStorageDocument:
+    # previous implementation: every method call resolved through __getattr__.
+    def __init__(self, exp_id, storage):
+        self._storage = storage
+        self._exp_id = exp_id
+
+    def __getattr__(self, method_name):
+        if method_name in ["to", "id", "storage", "__str__", "__repr__"]:
+            return super().__getattribute__(method_name)
+        else:
+            storage = self.storage()
+            exp_id = self.id()
+
+            method_name = "fields" if method_name == "keys" else method_name
+
+            return partial(getattr(storage, method_name), exp_id)
+
+    def id(self):
+        return super().__getattribute__("_exp_id")
+
+    def storage(self):
+        return super().__getattribute__("_storage")
+
+
+def main(number: int = 200_000):
+    storage = MemoryStorage("rw")
+    storage.create("exp")
+    storage.write("exp", "meta", {"name": "bench"})
+    storage.write("exp", "data", [])
+
+    documents = {
+        "dynamic": DynamicStorageDocument("exp", storage),
+        "bound": storage.document("exp"),
+    }
+
+    calls = {
+        "read": lambda d: d.read("meta"),
+        "keys": lambda d: d.keys(),
+        "read_subfield": lambda d: d.read_subfield("meta", "name"),
+    }
+
+    print(f"{'call':<16}{'dynamic (ns)':>14}{'bound (ns)':>14}{'speedup':>10}")
+    for name, call in calls.items():
+        timings = {
+            kind: min(
+                timeit.repeat(lambda: call(document), number=number, repeat=5)
+            )
+            / number
+            * 1e9
+            for kind, document in documents.items()
+        }
+        print(
+            f"{name:<16}{timings['dynamic']:>14.1f}{timings['bound']:>14.1f}"
+            f"{timings['dynamic'] / timings['bound']:>9.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
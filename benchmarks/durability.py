@@ -0,0 +1,62 @@
+"""
+Appends per second of DiskStorage under each durability policy.
+
+Several threads append single records to their own experiment, as concurrent
+generation workers would. "fsync each" syncs after every append (what a naive
+durable append costs); the group-commit policies share fsyncs between threads.
+
+    python -m benchmarks.durability
+"""
+
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from expkit.storage import DiskStorage
+
+POLICIES = {
+    "none": "none",
+    "close": "close",
+    "fsync each": {"records": 1},
+    "every 100": {"records": 100},
+    "every 10ms": {"interval_ms": 10},
+}
+
+
+def run(durability, threads: int, appends: int, list_format: str) -> float:
+    base_dir = tempfile.mkdtemp(dir=".")
+    try:
+        storage = DiskStorage(
+            base_dir, "rw", list_format=list_format, durability=durability
+        )
+        for t in range(threads):
+            storage.create(f"exp{t}")
+
+        record = {"input": {"prompt": "x" * 200}, "outputs": [{"text": "y" * 500}]}
+
+        def append(t):
+            for _ in range(appends):
+                storage.append_subfield(f"exp{t}", "data", record)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(append, range(threads)))
+        storage.close()
+        elapsed = time.perf_counter() - start
+
+        return threads * appends / elapsed
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def main(threads: int = 8, appends: int = 500, list_format: str = "jsonl"):
+    print(f"{threads} threads x {appends} appends, list_format={list_format}")
+    print(f"{'policy':<14}{'appends/s':>12}")
+    for name, durability in POLICIES.items():
+        rate = run(durability, threads, appends, list_format)
+        print(f"{name:<14}{rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Archive size and write/read time of ZipStorage compression policies.
+
+Each experiment has the usual field mix: a small `meta`, a text-heavy `data`
+list (prompts and sampled outputs with token logprobs) and a few numeric
+`eval_*` lists. Pass `--source <DiskStorage dir>` to measure real experiments
+instead of the synthetic ones.
+
+    python -m benchmarks.zip_compression
+"""
+
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+
+from expkit.storage import DiskStorage, ZipStorage
+
+POLICIES = {
+    "deflate-6 (default)": None,
+    "stored": {"default": ("stored", None)},
+    "deflate-1": {"default": ("deflate", 1)},
+    "deflate-9": {"default": ("deflate", 9)},
+    "bz2-9": {"default": ("bz2", 9)},
+    "lzma": {"default": ("lzma", None)},
+    "mixed": {
+        "default": ("deflate", 6),
+        "fields": {"data": ("lzma", None), "eval_*": ("deflate", 1)},
+        "min_size": 1024,
+    },
+}
+
+
+def _text(rng, words):
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+        for _ in range(words)
+    )
+
+
+def synthetic_experiments(n: int = 8, instances: int = 500, seed: int = 0):
+    rng = random.Random(seed)
+    vocabulary = [_text(rng, 1) for _ in range(2000)]
+
+    for e in range(n):
+        data = []
+        for i in range(instances):
+            outputs = []
+            for _ in range(4):
+                tokens = rng.choices(vocabulary, k=rng.randint(50, 200))
+                outputs.append(
+                    {
+                        "text": " ".join(tokens),
+                        "logprobs": [round(-rng.expovariate(1.0), 4) for _ in tokens],
+                    }
+                )
+            data.append(
+                {
+                    "input": {"prompt": " ".join(rng.choices(vocabulary, k=60))},
+                    "outputs": outputs,
+                }
+            )
+
+        yield f"exp{e}", {
+            "meta": {"model_path": "model", "dataset": "dataset", "n": instances},
+            "data": data,
+            "eval_reward": [[rng.random() for _ in range(4)] for _ in range(instances)],
+            "eval_accuracy": [rng.randint(0, 1) for _ in range(instances)],
+        }
+
+
+def disk_experiments(source: str):
+    storage = DiskStorage(source, "r")
+    for exp_id in storage.keys():
+        yield exp_id, {
+            field: storage.read(exp_id, field) for field in storage.fields(exp_id)
+        }
+
+
+def run(experiments, compression) -> dict:
+    base_dir = tempfile.mkdtemp(dir=".")
+    try:
+        storage = ZipStorage(base_dir, "rw", compression=compression)
+
+        start = time.perf_counter()
+        for exp_id, fields in experiments:
+            storage.create(exp_id)
+            for field, value in fields.items():
+                storage.write(exp_id, field, value)
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for exp_id in storage.keys():
+            storage.get(exp_id)
+        read_s = time.perf_counter() - start
+
+        size = sum(
+            os.path.getsize(os.path.join(base_dir, f)) for f in os.listdir(base_dir)
+        )
+        return {"size": size, "write_s": write_s, "read_s": read_s}
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def main(source: str = None, n: int = 8, instances: int = 500):
+    if source is None:
+        experiments = list(synthetic_experiments(n, instances))
+    else:
+        experiments = list(disk_experiments(source))
+
+    print(f"{'policy':<22}{'size (MB)':>11}{'write (s)':>11}{'read (s)':>10}")
+    for name, compression in POLICIES.items():
+        stats = run(experiments, compression)
+        print(
+            f"{name:<22}{stats['size'] / 1e6:>11.2f}"
+            f"{stats['write_s']:>11.2f}{stats['read_s']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
@@ -1,8 +1,9 @@
 from expkit.setup import ExpSetup
 
-from expkit.storage import DiskStorage
+from expkit.storage import DiskStorage, MongoStorage, ZipStorage
 
 from qflow.utils.eval import *
+import itertools
 import json
 
 from termcolor import colored
@@ -21,12 +22,31 @@ from termcolor import colored
 # 7d8f08c5-3d14-412e-94c9-a92acb05216a
 
 
+# expkit data --base_dir outputs/ --sample 5 --seed 0
+# expkit sync --base_dir outputs/ --target mongodb://localhost:27017/ --state outputs-mongo.sync
+# expkit sync --base_dir outputs/ --target zip:archive/ --state outputs-archive.sync
+
+
 # 3db1e043-2288-4f89-aa36-c41dcfef4f2a
+def open_storage(path: str, mode: str = "r"):
+    if path.startswith("mongodb://") or path.startswith("mongodb+srv://"):
+        return MongoStorage(path, mode=mode)
+    elif path.startswith("zip:"):
+        return ZipStorage(base_dir=path[len("zip:") :], mode=mode)
+    else:
+        return DiskStorage(base_dir=path, mode=mode)
+
+
 def main(
     mode="list",
     base_dir="outputs/",
     n: int = 1,
     query_args: str = {},
+    target: str = None,
+    state: str = None,
+    workers: int = 1,
+    sample: int = None,
+    seed: int = None,
 ):
 
     print(query_args)
@@ -36,26 +56,20 @@ def main(
     # r = {}
 
     if mode == "list":
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
-        )
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
 
         for e in setup.experiments:
             print(e.name)
 
     elif mode == "show":
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
-        )
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
 
         for e in setup.experiments:
             print("--" * 20)
             print(e)
 
     elif mode == "progress":
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
-        )
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
 
         for e in setup.sort("dataset"):
             print("--" * 20)
@@ -70,31 +84,38 @@ def main(
 
     elif mode == "data":
 
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
-        )
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
+
+        fields = ["input.prompt", "input.answer", "outputs.text"]
 
         for e in setup.experiments:
             if e.has_data():
-                print("--" * 20)
+                if sample is None:
+                    # only the first instance is decoded.
+                    shown = itertools.islice(
+                        e.instances(lazy_iterable=True, fields=fields), 1
+                    )
+                else:
+                    shown = e.instances(sample=sample, seed=seed, fields=fields)
 
-                data = e.instances()[0]
+                for data in shown:
+                    print("--" * 20)
 
-                print(f"{e.name} : {data['input']['prompt']}")
+                    print(f"{e.name} : {data['input']['prompt']}")
 
-                print("**" * 5 + "Answer" + "**" * 5)
-                print(data["input"]["answer"])
+                    print("**" * 5 + "Answer" + "**" * 5)
+                    print(data["input"]["answer"])
 
-                for j in range(min(n, len(data["outputs"]))):
-                    print("**" * 5 + f"{j}:Output" + "**" * 5)
+                    for j in range(min(n, len(data["outputs"]))):
+                        print("**" * 5 + f"{j}:Output" + "**" * 5)
 
-                    print(data["outputs"][j]["text"])
-                    print("..." * 20)
+                        print(data["outputs"][j]["text"])
+                        print("..." * 20)
 
     elif mode == "clean":
 
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="rw")).query(
-            query_args
+        setup = ExpSetup(
+            storage=open_storage(base_dir, mode="rw"), criteria=query_args
         )
 
         empty = setup.filter(lambda e: not e.has_data())
@@ -103,16 +124,28 @@ def main(
             print(e.name)
             e.document_storage.delete()
 
-    elif mode == "count":
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
+    elif mode == "sync":
+
+        if target is None:
+            raise ValueError("sync requires --target")
+
+        stats = open_storage(base_dir, "r").sync(
+            open_storage(target, "rw"),
+            state=state,
+            workers=workers,
         )
 
+        print(
+            f"synced {stats['documents']} documents, {stats['records']} records "
+            f"in {stats['seconds']:.1f}s"
+        )
+
+    elif mode == "count":
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
+
         print(len(setup.experiments))
     else:
-        setup = ExpSetup(storage=DiskStorage(base_dir=base_dir, mode="r")).query(
-            query_args
-        )
+        setup = ExpSetup(storage=open_storage(base_dir), criteria=query_args)
 
         e = setup[mode]
 
@@ -18,6 +18,7 @@ from expkit.storage import (
     MemoryStorage,
     MongoStorage,
 )
+from expkit.writer import InstanceWriter
 
 
 def create_lock(
@@ -47,6 +48,7 @@ class Exp:
         name: str = None,
         meta: Dict[str, str] = None,
         storage: Storage = None,
+        document: StorageDocument = None,
         **env_context_variables,
     ):
         """
@@ -55,14 +57,26 @@ class Exp:
         Args:
             name: The name of the experiment.
             meta: A dictionary containing metadata about the experiment.
+            document: An already opened document of an existing experiment. Its meta
+                is taken as given, without reading it back from the storage.
         """
 
+        if document is not None:
+            name = document.id()
+            storage = document.storage()
+
         self.name = str(uuid.uuid4()) if name is None else name
 
         if storage is None:
             storage = MemoryStorage(mode="rw")
 
-        if not storage.exists(self.name):
+        if document is not None:
+            document_storage = document
+
+            if meta is None:
+                meta = document_storage.read("meta")
+
+        elif not storage.exists(self.name):
             document_storage = storage.create(self.name)
 
             env_context_variables = {
@@ -107,10 +121,39 @@ class Exp:
 
         self.document_storage = document_storage
 
-    def instances(self, lazy_iterable=False):
+    def instances(
+        self,
+        lazy_iterable=False,
+        fields: List[str] = None,
+        where=None,
+        sample: int = None,
+        seed: int = None,
+    ):
+        """
+        Get the instances of the experiment.
+
+        Args:
+            lazy_iterable: Return an iterator instead of a list.
+            fields: Optional dotted paths (e.g. ["input.prompt", "outputs.text"]) to
+                keep from each instance. Lists are traversed elementwise.
+            where: Keep only matching instances; a callable or a dict from dotted
+                paths to values, e.g. {"input.dataset": "gsm8k"}.
+            sample: Return a uniform sample of this many instances.
+            seed: Seed of the sample.
+        """
 
         try:
-            if lazy_iterable:
+            if sample is not None:
+                instances = self.document_storage.sample(
+                    "data", sample, seed=seed, where=where, fields=fields
+                )
+                return iter(instances) if lazy_iterable else instances
+            elif fields is not None or where is not None:
+                instances = self.document_storage.iterable(
+                    "data", fields=fields, where=where
+                )
+                return instances if lazy_iterable else list(instances)
+            elif lazy_iterable:
                 return self.document_storage.iterable("data")
             else:
                 return self.document_storage.read("data")
@@ -119,10 +162,10 @@ class Exp:
 
     def __len__(self):
 
-        count = 0
-        for _ in self.instances(lazy_iterable=True):
-            count += 1
-        return count
+        try:
+            return self.document_storage.count("data")
+        except (FileNotFoundError, KeyError):
+            return 0
 
     def evals(self):
 
@@ -288,6 +331,24 @@ class Exp:
         for input_data, output in zip(inputs, outputs):
             self.add_instance(input_data, output)
 
+    def writer(self, **kwargs) -> InstanceWriter:
+        """
+        Open a write-behind writer for the instances of the experiment.
+
+        Instances added through the writer are written in batches by a background
+        thread; leaving the `with` block waits for them and raises write errors.
+
+            with exp.writer(batch_size=256) as writer:
+                for input, outputs in generate():
+                    writer.add_instance(input, outputs)
+
+        Args:
+            kwargs: Passed to `InstanceWriter` (batch_size, max_pending,
+                flush_interval).
+        """
+
+        return InstanceWriter(self.document_storage, **kwargs)
+
     def save(self, storage: Storage, **kwargs):
         """
         Save the experiment to disk.
@@ -115,6 +115,24 @@ def proj(key):
     return lambda x: x[key]
 
 
+# reductions that storages can run themselves (see `Storage.reduce`).
+PIPELINE_REDUCE = {
+    np.mean: "$avg",
+    np.max: "$max",
+    np.min: "$min",
+    np.sum: "$sum",
+    last: "$last",
+}
+
+PIPELINE_EXPERIMENT_REDUCE = {
+    identity: None,
+    np.mean: "$avg",
+    np.max: "$max",
+    np.min: "$min",
+    np.sum: "$sum",
+}
+
+
 class EvalReduceOperation(Operation):
     def __init__(
         self,
@@ -136,6 +154,32 @@ class EvalReduceOperation(Operation):
         )
         self.n = n
 
+    def __call__(self, exp):
+        """
+        Runs the reduction in the storage when it can (e.g. a Mongo
+        aggregation pipeline), otherwise on the evaluations read by the client.
+        """
+
+        if (
+            self.reduce in PIPELINE_REDUCE
+            and self.experiment_wide_reduce
+            in PIPELINE_EXPERIMENT_REDUCE
+        ):
+            try:
+                return exp.document_storage.reduce(
+                    exp.load_eval_meta()[self.key],
+                    self.entry_key,
+                    PIPELINE_REDUCE[self.reduce],
+                    PIPELINE_EXPERIMENT_REDUCE[
+                        self.experiment_wide_reduce
+                    ],
+                    n=self.n,
+                )
+            except NotImplementedError:
+                pass
+
+        return super().__call__(exp)
+
     def apply(self, instance_evals):
 
         v = self.experiment_wide_reduce(
@@ -25,6 +25,7 @@ class ExpSetup:
         self,
         storage,
         ops={},
+        criteria=None,
     ):
         """
         Initialize the ExperimentData object.
@@ -32,11 +33,13 @@ class ExpSetup:
         Args:
             base_path (str): The base path where the experiment data is located.
             ops (dict): A dictionary of functions to be applied to each experiment's full results.
+            criteria (dict): Only load the experiments matching these criteria (see `query`).
         """
 
         self.storage = storage
         self.experiments = []
         self.ops = ops
+        self.criteria = criteria
 
         self._load_data()
 
@@ -47,12 +50,21 @@ class ExpSetup:
         Load the experiment data from the base path.
         """
 
+        # the storage evaluates the criteria; catalogs do it with an index.
+        metas = self.storage.find(self.criteria)
+
+        if self.criteria is None:
+            # `find` leaves out experiments without a meta.
+            for name in self.storage.keys():
+                if name not in metas:
+                    print(f"Missing data for  {name}: 'meta'")
+
         self.experiments = list(
             filter(
                 lambda x: x is not None,
                 map(
-                    self._process_experiment,
-                    self.storage.keys(),
+                    lambda name: self._process_experiment(name, metas[name]),
+                    metas,
                 ),
             )
         )
@@ -89,21 +101,26 @@ class ExpSetup:
     def _process_experiment(
         self,
         experiment_name,
+        meta=None,
     ):
         """
         Process a single experiment.
 
         Args:
             experiment_name (str): The name of the experiment to process.
+            meta (dict): The experiment metadata, if already loaded.
 
         Returns:
             experiment: The processed experiment object.
         """
 
         try:
-            experiment = PExp.load(
-                storage=self.storage,
-                name=experiment_name,
+            if meta is None:
+                raise KeyError("meta")
+
+            experiment = PExp(
+                meta=meta,
+                document=self.storage.document(experiment_name),
                 ops=self.ops,
             )
             # experiment.run_ops()
@@ -231,7 +248,16 @@ class ExpSetup:
         return self.__str__()
 
     def get_all(self, key):
-        return [exp.get(key) for exp in self.experiments]
+        if key == "name":
+            return self.keys()
+
+        # evals take precedence over meta in Exp.get; fetch them in one batch.
+        evals = self.storage.read_many(self.keys(), "eval_" + key)
+
+        return [
+            evals[exp.get_name()] if exp.get_name() in evals else exp.get(key)
+            for exp in self.experiments
+        ]
 
     def print_get_table(self, *gets):
         metric_names = "".join([f"\t{m}" for m in gets])
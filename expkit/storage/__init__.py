@@ -2,10 +2,10 @@ from expkit.storage.disk import DiskStorage, CachedRODiskStorage
 
 from expkit.storage.memory import MemoryStorage
 
-from expkit.storage.mongo import MongoStorage
+from expkit.storage.mongo import MongoStorage, MongoInstanceStorage
 
 from expkit.storage.zip import ZipStorage
 
-from expkit.storage.cache import CachedRO
+from expkit.storage.cache import CachedRO, SharedCachedRO
 
 from expkit.storage.base import Storage, StorageDocument
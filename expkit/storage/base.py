@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 import pymongo
-from typing import List, Any
+from typing import List, Any, Dict, Callable, Union
 from copy import deepcopy
 import json
 import os
@@ -16,10 +16,114 @@ from pymongo import WriteConcern
 import asyncio
 from types import MappingProxyType
 import itertools
+import random
 import ijson
 
 LIST_SYM = ">>"
 
+MISSING = object()
+
+
+def chunked_iterable(iterable, size):
+    """Helper function to split iterable into chunks of given size."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def projection_tree(fields: List[str]) -> Dict[str, Any]:
+    """Turn dotted paths such as ["input.prompt", "outputs.text"] into a tree."""
+    tree = {}
+    for path in fields:
+        node = tree
+        for key in path.split("."):
+            node = node.setdefault(key, {})
+
+    return tree
+
+
+def project(value: Any, tree: Dict[str, Any]) -> Any:
+    """
+    Keep only the paths of a projection tree (see `projection_tree`).
+
+    Lists are traversed elementwise, so "outputs.text" selects the text of every
+    output. Keys missing from a record are left out.
+    """
+
+    if not tree:
+        return value
+    elif isinstance(value, list):
+        return [project(element, tree) for element in value]
+    elif isinstance(value, dict):
+        return {
+            key: project(value[key], subtree)
+            for key, subtree in tree.items()
+            if key in value
+        }
+    else:
+        return value
+
+
+def lookup(value: Any, path: str) -> Any:
+    """Value at a dotted path of nested dicts, or MISSING."""
+    for key in path.split("."):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return MISSING
+
+    return value
+
+
+def matches(element: Any, where: Union[Dict[str, Any], Callable]) -> bool:
+    """
+    Check an element against a predicate.
+
+    `where` is either a callable or a dict from dotted paths to the values they
+    must be equal to, e.g. {"input.dataset": "gsm8k"}.
+    """
+    if callable(where):
+        return where(element)
+    else:
+        return all(lookup(element, path) == value for path, value in where.items())
+
+
+def meta_matches(exp_id: str, meta: Dict[str, Any], criteria: Dict[str, Any]) -> bool:
+    """Check an experiment against `ExpSetup.query` criteria ("name" is the id)."""
+    return all(
+        exp_id == v if k == "name" else (k in meta and meta[k] == v)
+        for k, v in (criteria or {}).items()
+    )
+
+
+def select(elements, fields: List[str] = None, where=None):
+    """Filter elements with `where`, then apply the projection `fields`."""
+    if where is not None:
+        elements = (element for element in elements if matches(element, where))
+
+    if fields is not None:
+        tree = projection_tree(fields)
+        elements = (project(element, tree) for element in elements)
+
+    return elements
+
+
+def reservoir_sample(elements, k: int, rng: random.Random) -> List[tuple]:
+    """Uniform sample of k `(index, element)` pairs in one pass, in input order."""
+    reservoir = []
+    for i, element in enumerate(elements):
+        if i < k:
+            reservoir.append((i, element))
+        else:
+            j = rng.randrange(i + 1)
+            if j < k:
+                reservoir[j] = (i, element)
+
+    return sorted(reservoir, key=lambda pair: pair[0])
+
 
 class Storage:
 
@@ -33,6 +137,20 @@ class Storage:
     def is_read_mode(self):
         return self.read_mode
 
+    def flush(self, exp_id: str = None):
+        """Make pending writes (of `exp_id` only, if given) readable by others."""
+        pass
+
+    def close(self):
+        """Release the resources of the storage and make pending writes durable."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def create(
         self,
         exp_id: str,
@@ -46,11 +164,145 @@ class Storage:
     def exists(self, exp_id: str):
         pass
 
+    def get(self, exp_id: str):
+        pass
+
     def read(self, exp_id: str, field: str):  # field = {meta, evals, data}
         pass
 
-    def iterable(self, exp_id: str, field: str):
-        return self.read(exp_id, field)
+    def iterable(
+        self,
+        exp_id: str,
+        field: str,
+        fields: List[str] = None,
+        where=None,
+    ):
+        """
+        Iterate over the elements of a list field.
+
+        `fields` is an optional projection of dotted paths; only those paths are
+        kept from each element. `where` keeps only the elements it matches (see
+        `matches`).
+        """
+        if fields is None and where is None:
+            return self.read(exp_id, field)
+        else:
+            return select(self.read(exp_id, field), fields=fields, where=where)
+
+    def count(self, exp_id: str, field: str) -> int:
+        """Number of elements of a list field."""
+        return sum(1 for _ in self.iterable(exp_id, field))
+
+    def tail(self, exp_id: str, field: str, start: int):
+        """Iterate over the elements of a list field from index `start` on."""
+        return itertools.islice(self.iterable(exp_id, field), start, None)
+
+    def sample(
+        self,
+        exp_id: str,
+        field: str,
+        k: int,
+        seed: int = None,
+        where=None,
+        fields: List[str] = None,
+    ) -> List[Any]:
+        """
+        Uniformly sample k elements of a list field (fewer if it is shorter).
+
+        The elements are returned in their storage order. Only the sampled
+        elements are projected with `fields`.
+        """
+        sampled = reservoir_sample(
+            self.iterable(exp_id, field, where=where), k, random.Random(seed)
+        )
+        return list(select((element for _, element in sampled), fields=fields))
+
+    def reduce(
+        self,
+        exp_id: str,
+        field: str,
+        entry_key: str,
+        reduce: str,
+        experiment_reduce: str = None,
+        n: int = None,
+    ):
+        """
+        Reduce a list field where it is stored, for storages that can.
+
+        The `entry_key` list of each element (its first `n` values, if given)
+        is reduced with `reduce`, one of "$avg", "$max", "$min", "$sum" or
+        "$last". The per-element results are returned in order, or reduced
+        once more with `experiment_reduce`. Storages that cannot do this raise
+        NotImplementedError, and `EvalReduceOperation` reduces client side.
+        """
+        raise NotImplementedError
+
+    def read_many(
+        self,
+        exp_ids: List[str],
+        field: str,
+        workers: int = 8,
+    ) -> Dict[str, Any]:
+        """
+        Read `field` from several experiments at once.
+
+        Returns a dict from experiment id to value. Experiments without the
+        field, or missing altogether, are left out; other errors are raised.
+        """
+
+        def read_one(exp_id):
+            try:
+                return exp_id, self.read(exp_id, field)
+            except KeyError:
+                return exp_id, MISSING
+            except FileNotFoundError:
+                # file based storages; only a missing experiment or field is
+                # expected.
+                if self.exists(exp_id) and field in self.fields(exp_id):
+                    raise
+                return exp_id, MISSING
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return {
+                exp_id: value
+                for exp_id, value in pool.map(read_one, exp_ids)
+                if value is not MISSING
+            }
+
+    def get_many(
+        self,
+        exp_ids: List[str],
+        workers: int = 8,
+    ) -> Dict[str, dict]:
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return dict(zip(exp_ids, pool.map(self.get, exp_ids)))
+
+    def find(self, criteria: Dict[str, Any] = None) -> Dict[str, dict]:
+        """
+        Metas of the experiments matching `criteria`, by experiment id.
+
+        `criteria` maps "name" or meta keys to the values they must be equal to
+        (see `ExpSetup.query`). Experiments without a meta are left out.
+        Storages that can evaluate the criteria in place override this.
+        """
+        names = self.keys()
+        if criteria is not None and "name" in criteria:
+            names = [name for name in names if name == criteria["name"]]
+
+        metas = self.read_many(names, "meta")
+        return {
+            exp_id: meta
+            for exp_id, meta in metas.items()
+            if meta_matches(exp_id, meta, criteria)
+        }
+
+    def is_list(self, exp_id: str, field: str) -> bool:
+        return isinstance(self.read(exp_id, field), list)
+
+    def field_version(self, exp_id: str, field: str):
+        # cheap stamp that changes whenever the field changes; None if unknown.
+        return None
 
     def keys(
         self,
@@ -91,10 +343,41 @@ class Storage:
     def document(self, exp_id: str):
         return StorageDocument(exp_id, self)
 
-    def to(self, storage, **kwargs):
+    def to(
+        self,
+        storage,
+        workers: int = 1,
+        chunk_size: int = 1000,
+        journal: str = None,
+        **kwargs,
+    ):
+        from expkit.storage.migrate import Migration
+
+        return Migration(
+            self,
+            storage,
+            workers=workers,
+            chunk_size=chunk_size,
+            journal=journal,
+            **kwargs,
+        ).run()
+
+    def sync(
+        self,
+        storage,
+        state: str = None,
+        workers: int = 1,
+        chunk_size: int = 1000,
+    ):
+        from expkit.storage.migrate import Sync
 
-        for exp_id in tqdm(self.keys()):
-            self.document(exp_id).to(storage, **kwargs)
+        return Sync(
+            self,
+            storage,
+            state=state,
+            workers=workers,
+            chunk_size=chunk_size,
+        ).run()
 
     def append_subfield(
         self,
@@ -132,6 +415,41 @@ class Storage:
         else:
             raise ValueError("Write mode is not enabled.")
 
+    def extend_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+    ):
+
+        if self.is_write_mode():
+
+            if not self.exists(exp_id):
+
+                raise ValueError(f"Collection {exp_id} does not exist.")
+
+            try:
+                list_data = self.read(exp_id, field)
+            except (
+                KeyError,
+                FileNotFoundError,
+            ):  # not initialized.
+                list_data = []
+
+            if not isinstance(list_data, list):
+                raise ValueError(f"Field:{field} is not a list.")
+
+            list_data.extend(data)
+
+            self.write(
+                exp_id,
+                field,
+                list_data,
+            )
+
+        else:
+            raise ValueError("Write mode is not enabled.")
+
     def __str__(self) -> str:
         return f"Storage(documents={self.keys()})"
 
@@ -140,10 +458,49 @@ class Storage:
 
 
 class StorageDocument:
+    """
+    A storage bound to a single experiment id.
+
+    Storage methods taking the id as first argument are bound once, at
+    construction, so calls like `document.read("data")` cost a single call.
+    Storage-specific methods not listed in `BOUND_METHODS` are still reachable
+    through `__getattr__`.
+    """
+
+    BOUND_METHODS = (
+        "read",
+        "write",
+        "iterable",
+        "count",
+        "sample",
+        "reduce",
+        "is_list",
+        "field_version",
+        "fields",
+        "read_field_keys",
+        "read_subfield",
+        "write_subfield",
+        "append_subfield",
+        "extend_subfield",
+        "exists",
+        "delete",
+        "get",
+    )
+
+    __slots__ = ("_storage", "_exp_id", "keys") + BOUND_METHODS
+
     def __init__(self, exp_id: str, storage: Storage):
         self._storage = storage
         self._exp_id = exp_id
 
+        for method_name in self.BOUND_METHODS:
+            setattr(self, method_name, partial(getattr(storage, method_name), exp_id))
+
+        self.keys = self.fields
+
+    def __reduce__(self):
+        return (StorageDocument, (self._exp_id, self._storage))
+
     def __setitem__(self, field: str, data: Any):
 
         if "." not in field:
@@ -166,44 +523,26 @@ class StorageDocument:
 
     def __getattr__(self, method_name: str) -> Any:
 
-        if method_name in [
-            "to",
-            "id",
-            "storage",
-            "__str__",
-            "__repr__",
-        ]:
-            return super().__getattribute__(method_name)
-        else:
-            storage = self.storage()
-            exp_id = self.id()
+        if method_name.startswith("_"):
+            raise AttributeError(method_name)
 
-            method_name = "fields" if method_name == "keys" else method_name
+        return partial(
+            getattr(self._storage, method_name),
+            self._exp_id,
+        )
 
-            return partial(
-                getattr(storage, method_name),
-                exp_id,
-            )
-
-    def to(self, storage: Storage, **kwargs):
-        exp_id = self.id()
+    def to(self, storage: Storage, chunk_size: int = 1000, **kwargs):
+        from expkit.storage.migrate import copy_document
 
-        document = storage.create(exp_id=exp_id, **kwargs)
-
-        for k in self.keys():
-            data = self.read(k)
-            print(f"~read {len(data)} elements from {k}")
-            document.write(k, data)
+        document, _, _ = copy_document(self, storage, chunk_size=chunk_size, **kwargs)
 
         return document
 
     def id(self):
-        exp_id = super().__getattribute__("_exp_id")
-
-        return exp_id
+        return self._exp_id
 
     def storage(self):
-        return super().__getattribute__("_storage")
+        return self._storage
 
     def __str__(self) -> str:
         return f"StorageDocument(exp_id={self.id()},data={self.keys()}, storage={self.storage()})"
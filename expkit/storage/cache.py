@@ -2,6 +2,15 @@ import asyncio
 from types import MappingProxyType
 import itertools
 import ijson
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Any
+
+import orjson
 
 from expkit.storage.base import Storage
 from expkit.storage.memory import MemoryStorage
@@ -66,3 +75,145 @@ class CachedRO(Storage):
 
     def exists(self, exp_id: str) -> bool:
         return self.source_storage.exists(exp_id)
+
+
+SHARED_MAGIC = b"EXPK\x02"
+SHARED_HEADER = struct.Struct("<5sQ20s")  # magic, payload length, version digest
+
+
+def default_shared_cache_dir() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "expkit-cache")
+
+
+def shared_namespace(storage: Storage) -> str:
+    # the same relative path from two working directories, or the same server
+    # with two databases, are different sources.
+    if getattr(storage, "base_dir", None) is not None:
+        location = os.path.abspath(storage.base_dir)
+    else:
+        location = getattr(storage, "uri", "")
+
+        db = getattr(storage, "db", None)
+        if db is not None:
+            location = f"{location}/{db.name}"
+
+        experiments = getattr(storage, "experiments", None)
+        if experiments is not None:
+            location = f"{location}/{experiments.name}"
+
+    return f"{type(storage).__name__}:{location}"
+
+
+def version_digest(version) -> bytes:
+    return hashlib.sha1(orjson.dumps(version)).digest()
+
+
+class SharedCachedRO(CachedRO):
+    """
+    Read-only cache shared by every process that points at the same cache_dir.
+
+    Fields are stored once as memory-mapped files (a small header followed by the
+    orjson payload). The first process to load a field publishes it; the others
+    decode straight from the mapping, without re-reading the source storage or
+    holding a private copy of the encoded bytes.
+
+    Entries record the source's `field_version` and are reloaded when it
+    changed. Sources without version stamps (e.g. Mongo) keep their entries
+    until `clear`, or for `ttl` seconds if given.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        cache_dir: str = None,
+        namespace: str = None,
+        ttl: float = None,
+    ):
+
+        super().__init__(storage)
+
+        self.ttl = ttl
+
+        if namespace is None:
+            namespace = shared_namespace(storage)
+
+        self.cache_dir = os.path.join(
+            default_shared_cache_dir() if cache_dir is None else cache_dir,
+            hashlib.sha1(namespace.encode()).hexdigest()[:16],
+        )
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, exp_id: str, field: str) -> str:
+        key = hashlib.sha1(f"{exp_id}/{field}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _load_shared(self, path: str, version: bytes):
+        with open(path, "rb") as file:
+            age = time.time() - os.fstat(file.fileno()).st_mtime
+            if self.ttl is not None and age > self.ttl:
+                raise FileNotFoundError(path)
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, length, entry_version = SHARED_HEADER.unpack_from(mm)
+
+                if magic != SHARED_MAGIC:
+                    raise ValueError(f"Corrupted cache entry {path}.")
+
+                if entry_version != version:
+                    # the source changed since the entry was published.
+                    raise FileNotFoundError(path)
+
+                with memoryview(mm) as view:
+                    with view[SHARED_HEADER.size : SHARED_HEADER.size + length] as payload:
+                        return orjson.loads(payload)
+
+    def _publish(self, path: str, data: Any, version: bytes):
+        payload = orjson.dumps(data)
+
+        # write to a private file and rename, so readers never see a partial
+        # entry. The name is unique per call, so threads publishing the same
+        # entry do not share it; the last rename wins.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            # readable by other workers, like entries opened with `open`.
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as file:
+                file.write(SHARED_HEADER.pack(SHARED_MAGIC, len(payload), version))
+                file.write(payload)
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        for f in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, f))
+            except FileNotFoundError:
+                pass
+
+    def read(self, exp_id: str, field: str):
+
+        if field == "meta":
+            return self.source_storage.read(exp_id, field)
+
+        path = self._entry_path(exp_id, field)
+        version = version_digest(self.source_storage.field_version(exp_id, field))
+
+        try:
+            return self._load_shared(path, version)
+        except FileNotFoundError:
+            data = self.source_storage.read(exp_id, field)
+            self._publish(path, data, version)
+            return data
+
+    def read_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        key: str,
+    ):
+        return self.read(exp_id, field)[key]
@@ -1,30 +1,424 @@
+import fcntl
+import hashlib
+import io
+import mmap
 import os
+import random
+import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
+from contextlib import contextmanager, nullcontext
 
 import orjson
 
-import ijson
-
-from expkit.storage.base import Storage
+from expkit.storage.base import Storage, chunked_iterable, select
+from expkit.storage.jsonstream import count_json_array, iter_json_array
 from expkit.storage.cache import CachedRO
+from expkit.storage.durability import make_durability
 from typing import Any, List
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+LIST_FORMATS = ("json", "jsonl")
+
+LAYOUTS = ("flat", "sharded")
+
+SHARD_NAME = re.compile(r"[0-9a-f]{2}")
+STAGING_PREFIX = ".reshard-"  # experiments parked by an unfinished reshard
+
+CODEC_EXTENSIONS = {None: "", "zstd": ".zst", "lz4": ".lz4"}
+
+SEGMENT_MARK = ".seg-"  # <field>.seg-<writer>.jsonl
+
+JSONL_CHUNK_SIZE = 1 << 22  # 4MB
+JSONL_PARALLEL_SIZE = 1 << 26  # files above 64MB are parsed by several processes
+READ_RETRIES = 5  # decodes of a JSON array retried while an append changes it
+
+
+def decode_jsonl(data: bytes) -> List[Any]:
+    # every line is one orjson document (orjson never emits raw newlines),
+    # so the lines can be decoded as a single array in one call.
+    lines = b",".join(line for line in data.split(b"\n") if line.strip())
+    return orjson.loads(b"[" + lines + b"]")
+
+
+def iter_jsonl(file, chunk_size: int = JSONL_CHUNK_SIZE):
+    # read large chunks and decode all complete lines of a chunk at once.
+    rest = b""
+    while True:
+        chunk = file.read(chunk_size)
+
+        if not chunk:
+            if rest.strip():
+                yield orjson.loads(rest)
+            return
+
+        chunk = rest + chunk
+        cut = chunk.rfind(b"\n") + 1
+        rest = chunk[cut:]
+
+        if cut > 0:
+            yield from decode_jsonl(chunk[:cut])
+
+
+def file_codec(file_path: str):
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if codec is not None and file_path.endswith(extension):
+            return codec
+
+    return None
+
+
+def _check_codec(codec):
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"Unknown compression {codec}.")
+    elif codec == "zstd" and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package.")
+    elif codec == "lz4" and lz4 is None:
+        raise ImportError("lz4 compression requires the lz4 package.")
+
+
+def compress_frame(codec, payload: bytes) -> bytes:
+    # every write is a self-contained frame; readers decode across frames.
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    elif codec == "lz4":
+        return lz4.frame.compress(payload)
+    else:
+        return payload
+
+
+@contextmanager
+def open_decompressed(file_path: str):
+    codec = file_codec(file_path)
+    _check_codec(codec)
+
+    with open(file_path, "rb") as file:
+        if codec == "zstd":
+            with zstandard.ZstdDecompressor().stream_reader(
+                file, read_across_frames=True
+            ) as reader:
+                yield reader
+        elif codec == "lz4":
+            with lz4.frame.LZ4FrameFile(file) as reader:
+                yield reader
+        else:
+            yield file
+
+
+def append_lines(file_path: str, data: List[Any]):
+    payload = compress_frame(
+        file_codec(file_path),
+        b"".join(orjson.dumps(d) + b"\n" for d in data),
+    )
+
+    fd = os.open(file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(payload)
+        while len(view) > 0:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def mapped(file_path: str):
+    """Read-only memory map of a file (an empty buffer for empty files)."""
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _decode_jsonl_range(file_path: str, start: int, end: int) -> List[Any]:
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        return decode_jsonl(file.read(end - start))
+
+
+def _iter_jsonl_from(file_path: str, start: int):
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        yield from iter_jsonl(file)
+
+
+def _jsonl_ranges(file_path: str, parts: int) -> List[tuple]:
+    # split the file in `parts` byte ranges that end on line boundaries.
+    size = os.path.getsize(file_path)
+    bounds = [0]
+
+    with open(file_path, "rb") as file:
+        for i in range(1, parts):
+            file.seek(max(size * i // parts, bounds[-1]))
+            file.readline()
+            bounds.append(min(file.tell(), size))
+
+    bounds.append(size)
+
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
 
 class DiskStorage(Storage):
-    def __init__(self, base_dir: str, mode: str = "r"):
+    """
+    Stores each experiment as a directory with one file per field.
+
+    List fields are kept either as a single JSON array (`list_format="json"`,
+    `<field>.json`) or as JSON Lines (`list_format="jsonl"`, `<field>.jsonl`),
+    where every append is a plain O_APPEND write and reads can be split on line
+    boundaries. Both layouts are always readable; `list_format` only decides
+    how new list fields are written. `stream_decoder` selects how JSON arrays
+    are streamed by `iterable` (see `jsonstream.iter_json_array`).
+
+    With `compression="zstd"` or `"lz4"` new fields are written compressed
+    (`<field>.json.zst`, `<field>.jsonl.lz4`, ...). Compressed list fields are
+    always JSON Lines, and every append adds one compressed frame, so appends
+    never rewrite the file. Compressed and plain files can be mixed.
+
+    With `layout="sharded"` experiment directories are placed under two levels
+    of hash-prefix directories (`ab/cd/<exp_id>`), so no directory grows with
+    the number of experiments. `reshard` moves an existing tree between layouts.
+    Without `layout` it is detected from the tree; an explicit `layout` must
+    match the tree unless it is empty.
+
+    With `writer="<name>"` appends go to a segment file owned by that writer
+    (`<field>.seg-<name>.jsonl`), so several processes can append to the same
+    experiment without sharing a file. Reads merge the field file and every
+    segment, in that order and segments sorted by writer name. `compact` folds
+    the segments back into the field file.
+
+    Writes are not fsynced by default. `durability` selects when they are made
+    durable: "close" syncs on `close`, {"records": n} after every n records and
+    {"interval_ms": t} every t milliseconds; concurrent writes share one fsync
+    (see `durability.GroupCommit`).
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        mode: str = "r",
+        list_format: str = "json",
+        parse_workers: int = 1,
+        stream_decoder: str = "auto",
+        compression: str = None,
+        layout: str = None,
+        writer: str = None,
+        durability="none",
+    ):
         super().__init__(mode)
         self.base_dir = base_dir
 
+        if layout is not None and layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout}.")
+
+        self.layout = layout
+
+        if list_format not in LIST_FORMATS:
+            raise ValueError(f"Unknown list format {list_format}.")
+
+        _check_codec(compression)
+
+        self.list_format = list_format
+        self.compression = compression
+
+        # layouts to look for when reading a field, the configured one first.
+        codec_extensions = dict.fromkeys(
+            [CODEC_EXTENSIONS[compression], *CODEC_EXTENSIONS.values()]
+        )
+        self._extensions = [
+            f".{fmt}{ext}" for ext in codec_extensions for fmt in LIST_FORMATS
+        ]
+        self.parse_workers = parse_workers
+        self.stream_decoder = stream_decoder
+        self._offsets = {}
+
+        if writer is not None and ("." in writer or "/" in writer):
+            raise ValueError(f"Invalid writer name {writer}.")
+
+        self.writer = writer
+        self._durability = make_durability(durability)
+
         if not self.valid_storage():
             raise ValueError(
                 "Invalid storage. This path already has dir files. It has a storage of other type."
             )
 
+        detected = self.detect_layout()
+        if self.layout is None:
+            self.layout = detected
+        elif self.layout != detected and not self._is_empty():
+            raise ValueError(
+                f"{base_dir} has a {detected} layout, not {layout}. Open it "
+                "without `layout` and `reshard` it to change the layout."
+            )
+
+    def _is_empty(self) -> bool:
+        with os.scandir(self.base_dir) as entries:
+            return not any(not e.name.startswith(".") for e in entries)
+
     def valid_storage(self) -> List[str]:
         if not self.is_read_mode():
             raise ValueError("Read mode is not enabled.")
 
-        return not (len([1 for f in os.listdir(self.base_dir) if "." in f]) > 0)
+        # dot-files are our own (e.g. experiments parked by `reshard`).
+        return not any(
+            "." in f and not f.startswith(".") for f in os.listdir(self.base_dir)
+        )
+
+    def _dir_path(self, exp_id: str, layout: str = None) -> str:
+        layout = self.layout if layout is None else layout
+
+        if layout == "sharded":
+            digest = hashlib.sha1(exp_id.encode()).hexdigest()
+            return f"{self.base_dir}/{digest[:2]}/{digest[2:4]}/{exp_id}"
+        else:
+            return f"{self.base_dir}/{exp_id}"
+
+    @staticmethod
+    def _shard_dirs(entry) -> List[str]:
+        """
+        Second-level shard directories of a top-level entry, or None when the
+        entry is not a shard (e.g. an experiment, whatever its name).
+        """
+        if not (entry.is_dir() and SHARD_NAME.fullmatch(entry.name)):
+            return None
+
+        with os.scandir(entry.path) as children:
+            children = [c for c in children if not c.name.startswith(".")]
+
+        # experiment directories hold field files, shards only shard dirs.
+        if len(children) == 0 or not all(
+            c.is_dir() and SHARD_NAME.fullmatch(c.name) for c in children
+        ):
+            return None
+
+        return [c.path for c in children]
+
+    def _scan(self) -> dict:
+        """
+        Directory of every experiment, from the tree as it is on disk.
+
+        Flat, sharded and partially resharded trees are all understood, so
+        the result does not depend on `layout`.
+        """
+        with os.scandir(self.base_dir) as entries:
+            top = [e for e in entries if not e.name.startswith(".")]
+
+        def list_entry(entry):
+            shard_dirs = self._shard_dirs(entry)
+            if shard_dirs is None:
+                return [(entry.name, entry.path)]
+
+            found = []
+            for shard_dir in shard_dirs:
+                with os.scandir(shard_dir) as experiments:
+                    found.extend(
+                        (e.name, e.path)
+                        for e in experiments
+                        if not e.name.startswith(".")
+                    )
+            return found
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            return {
+                exp_id: path
+                for found in pool.map(list_entry, top)
+                for exp_id, path in found
+            }
+
+    def detect_layout(self) -> str:
+        """The layout of the tree: "sharded" if it has any shard directory."""
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if not entry.name.startswith(".") and self._shard_dirs(entry):
+                    return "sharded"
+
+        return "flat"
+
+    def _field_path(self, exp_id: str, field: str) -> str:
+        # path of an existing field file, in whichever layout it was written.
+        base_path = f"{self._dir_path(exp_id)}/{field}"
+
+        for extension in self._extensions:
+            if os.path.exists(base_path + extension):
+                return base_path + extension
+
+        raise FileNotFoundError(f"{base_path}.json")
+
+    def _new_field_path(
+        self, exp_id: str, field: str, is_list: bool, list_format: str = None
+    ) -> str:
+        # path a field is written to in this storage's layout.
+        list_format = self.list_format if list_format is None else list_format
+
+        if is_list and (list_format == "jsonl" or self.compression is not None):
+            extension = ".jsonl"
+        else:
+            extension = ".json"
+
+        return f"{self._dir_path(exp_id)}/{field}{extension}{CODEC_EXTENSIONS[self.compression]}"
+
+    def _replace_field(self, exp_id: str, field: str, file_path: str):
+        # remove copies of the field stored in another layout, and its segments.
+        base_path = f"{self._dir_path(exp_id)}/{field}"
+
+        for extension in self._extensions:
+            # the field was rewritten; its record index is stale.
+            self._offsets.pop(base_path + extension, None)
+
+            if base_path + extension != file_path and os.path.exists(
+                base_path + extension
+            ):
+                os.remove(base_path + extension)
+
+        for segment_path in self._segment_paths(exp_id, field):
+            os.remove(segment_path)
+
+    def _written(self, file_path: str, records: int, created: bool = False):
+        if self._durability is not None:
+            self._durability.written(file_path, records, created)
+
+    def close(self):
+        if self._durability is not None:
+            self._durability.close()
+
+    def _segment_paths(self, exp_id: str, field: str) -> List[str]:
+        dir_path = self._dir_path(exp_id)
+        prefix = f"{field}{SEGMENT_MARK}"
+
+        try:
+            files = os.listdir(dir_path)
+        except FileNotFoundError:
+            return []
+
+        return [f"{dir_path}/{file}" for file in sorted(files) if file.startswith(prefix)]
+
+    def _segment_path(self, exp_id: str, field: str) -> str:
+        return (
+            f"{self._dir_path(exp_id)}/{field}{SEGMENT_MARK}{self.writer}.jsonl"
+            f"{CODEC_EXTENSIONS[self.compression]}"
+        )
+
+    @contextmanager
+    def _field_lock(self, exp_id: str, field: str, exclusive: bool = False):
+        # segment writers and readers share the lock; compaction holds it alone.
+        fd = os.open(f"{self._dir_path(exp_id)}/.{field}.lock", os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
 
     def create(
         self,
@@ -33,7 +427,7 @@ class DiskStorage(Storage):
         exists_ok=False,
     ):
         if self.is_write_mode():
-            dir_path = f"{self.base_dir}/{exp_id}"
+            dir_path = self._dir_path(exp_id)
 
             if self.exists(exp_id):
                 if exists_ok:
@@ -43,6 +437,13 @@ class DiskStorage(Storage):
                 else:
                     raise ValueError(f"Document {exp_id} already exists.")
 
+            if self._durability is not None:
+                # sync the entries of every directory created on the way.
+                new_dir = dir_path
+                while not os.path.exists(new_dir):
+                    self._durability.created(new_dir)
+                    new_dir = os.path.dirname(new_dir)
+
             os.makedirs(dir_path, exist_ok=True)
 
             return self.document(exp_id)
@@ -52,36 +453,108 @@ class DiskStorage(Storage):
 
     def delete(self, exp_id: str):
         if self.is_write_mode():
-            dir_path = f"{self.base_dir}/{exp_id}"
+            dir_path = self._dir_path(exp_id)
             shutil.rmtree(dir_path)
         else:
             raise ValueError("Write mode is not enabled.")
 
     def exists(self, exp_id: str):
         if self.is_read_mode():
-            dir_path = f"{self.base_dir}/{exp_id}"
+            dir_path = self._dir_path(exp_id)
             return os.path.exists(dir_path)
         else:
             raise ValueError("Read mode is not enabled.")
 
     def keys(self):
         if self.is_read_mode():
-            return os.listdir(self.base_dir)
+            return list(self._scan())
         else:
             raise ValueError("Read mode is not enabled.")
 
+    def reshard(self, layout: str):
+        """
+        Move every experiment of this storage to `layout` and switch to it.
+
+        Directories are renamed, not copied. Experiments whose name could be
+        taken for a shard directory (two hex digits) are parked under
+        `.reshard-<exp_id>` while shards are created or removed. An interrupted
+        reshard is finished by running it again, with either layout.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout}.")
+
+        # experiments parked by an interrupted run.
+        staged = [
+            (name[len(STAGING_PREFIX) :], f"{self.base_dir}/{name}")
+            for name in os.listdir(self.base_dir)
+            if name.startswith(STAGING_PREFIX)
+        ]
+
+        moves = [
+            (exp_id, path, self._dir_path(exp_id, layout))
+            for exp_id, path in self._scan().items()
+            if path != self._dir_path(exp_id, layout)
+        ]
+
+        def park(exp_id, path):
+            staging_path = f"{self.base_dir}/{STAGING_PREFIX}{exp_id}"
+            os.rename(path, staging_path)
+            staged.append((exp_id, staging_path))
+
+        # flat experiments named like shards would have shards created inside.
+        if layout == "sharded":
+            for exp_id, old_path, _ in moves:
+                if old_path == self._dir_path(exp_id, "flat") and SHARD_NAME.fullmatch(
+                    exp_id
+                ):
+                    park(exp_id, old_path)
+
+        emptied = set()
+
+        parked = {exp_id for exp_id, _ in staged}
+
+        for exp_id, old_path, new_path in moves:
+            if exp_id in parked:
+                continue
+            elif layout == "flat" and SHARD_NAME.fullmatch(exp_id):
+                # its flat path may still be a shard; place it once they are gone.
+                park(exp_id, old_path)
+            elif os.path.exists(new_path):
+                raise ValueError(f"Cannot move {exp_id}, {new_path} already exists.")
+            else:
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.rename(old_path, new_path)
+
+            if old_path != self._dir_path(exp_id, "flat"):
+                emptied.add(os.path.dirname(old_path))
+
+        # drop the shard directories left empty, innermost level first.
+        for path in [*emptied, *{os.path.dirname(shard) for shard in emptied}]:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+        for exp_id, staging_path in staged:
+            new_path = self._dir_path(exp_id, layout)
+            if os.path.exists(new_path):
+                raise ValueError(f"Cannot move {exp_id}, {new_path} already exists.")
+
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.rename(staging_path, new_path)
+
+        self.layout = layout
+
     def get(self, exp_id: str):
         if self.is_read_mode():
 
             return {
                 "_id": exp_id,
-                **{
-                    subdir.split(".")[0]: self.read(
-                        exp_id,
-                        subdir.split(".")[0],
-                    )
-                    for subdir in os.listdir(f"{self.base_dir}/{exp_id}")
-                },
+                **{field: self.read(exp_id, field) for field in self.fields(exp_id)},
             }
 
         else:
@@ -89,18 +562,118 @@ class DiskStorage(Storage):
 
     def read(self, exp_id: str, field: str):  # field = {meta, evals, data}
         if self.is_read_mode():
-            file_path = f"{self.base_dir}/{exp_id}/{field}.json"
+            if len(self._segment_paths(exp_id, field)) > 0:
+                with self._field_lock(exp_id, field):
+                    return list(self._iter_field(exp_id, field, self._read_file))
+
+            return self._read_file(self._field_path(exp_id, field))
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _read_file(self, file_path: str):
+        if file_codec(file_path) is not None:
+            with open_decompressed(file_path) as file:
+                data = file.read()
+
+            return decode_jsonl(data) if ".jsonl" in file_path else orjson.loads(data)
+
+        if file_path.endswith(".jsonl"):
+            return self._read_jsonl(file_path)
+
+        # decode straight from the page cache, without a copy of the file.
+        # appends patch JSON arrays in place, so a map taken mid-append can
+        # end in a "," instead of the closing "]"; decode again once the file
+        # changed.
+        for attempt in range(READ_RETRIES):
+            stat = os.stat(file_path)
+            try:
+                with mapped(file_path) as mm:
+                    with memoryview(mm) as view:
+                        return orjson.loads(view)
+            except orjson.JSONDecodeError:
+                changed = os.stat(file_path)
+                if attempt == READ_RETRIES - 1 or (
+                    (changed.st_size, changed.st_mtime_ns)
+                    == (stat.st_size, stat.st_mtime_ns)
+                ):
+                    raise
+
+    def _iter_file(self, file_path: str):
+        if file_codec(file_path) is not None:
+            opened = open_decompressed(file_path)
+        else:
+            opened = mapped(file_path)
+
+        with opened as file:
+            if isinstance(file, bytes):
+                file = io.BytesIO(file)
+
+            if ".jsonl" in file_path:
+                yield from iter_jsonl(file)
+            else:
+                yield from iter_json_array(file, self.stream_decoder)
 
-            with open(file_path, "rb") as file:
-                return orjson.loads(file.read())
+    def _iter_field(self, exp_id: str, field: str, load):
+        # elements of the field file followed by those of every segment.
+        segment_paths = self._segment_paths(exp_id, field)
+
+        try:
+            file_paths = [self._field_path(exp_id, field), *segment_paths]
+        except FileNotFoundError:
+            if len(segment_paths) == 0:
+                raise
+            file_paths = segment_paths
+
+        for file_path in file_paths:
+            yield from load(file_path)
+
+    @contextmanager
+    def view(self, exp_id: str, field: str):
+        """
+        Zero-copy access to the raw bytes of a field file.
+
+        Yields a read-only memoryview over a memory map of the file. The view
+        must not be used after the context exits. `write` replaces the file,
+        so an open view keeps the bytes it was opened on, but appends to a
+        JSON array patch the file in place: the view then ends in "," where
+        the closing "]" was and misses the new elements, so views of list
+        fields that are still being appended to may not decode. JSON Lines
+        appends only add bytes past the end of the view.
+        """
+        if self.is_read_mode():
+            with mapped(self._field_path(exp_id, field)) as mm:
+                with memoryview(mm) as raw:
+                    yield raw
         else:
             raise ValueError("Read mode is not enabled.")
 
+    def _read_jsonl(self, file_path: str) -> List[Any]:
+        if (
+            self.parse_workers > 1
+            and os.path.getsize(file_path) > JSONL_PARALLEL_SIZE
+        ):
+            ranges = _jsonl_ranges(file_path, self.parse_workers)
+
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                parts = pool.map(
+                    _decode_jsonl_range,
+                    [file_path] * len(ranges),
+                    *zip(*ranges),
+                )
+                return [item for part in parts for item in part]
+
+        with open(file_path, "rb") as file:
+            return decode_jsonl(file.read())
+
     def fields(self, exp_id: str):  # field = {meta, evals, data}
         if self.is_read_mode():
-            dir_path = f"{self.base_dir}/{exp_id}"
+            dir_path = self._dir_path(exp_id)
             files = os.listdir(dir_path)
-            return [file.split(".")[0] for file in files]
+            return list(
+                dict.fromkeys(
+                    file.split(".")[0] for file in files if not file.startswith(".")
+                )
+            )
         else:
             raise ValueError("Read mode is not enabled.")
 
@@ -134,10 +707,23 @@ class DiskStorage(Storage):
         data: dict,
     ):
         if self.is_write_mode():
-            file_path = f"{self.base_dir}/{exp_id}/{field}.json"
 
-            with open(file_path, "wb") as f:
-                f.write(orjson.dumps(data))
+            file_path = self._new_field_path(exp_id, field, isinstance(data, list))
+
+            if ".jsonl" in file_path:
+                payload = b"".join(orjson.dumps(d) + b"\n" for d in data)
+            else:
+                payload = orjson.dumps(data)
+
+            # write a new file and rename it over the old one: truncating in
+            # place would break readers that memory map it (see `view`).
+            tmp_path = f"{self._dir_path(exp_id)}/.{field}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compress_frame(self.compression, payload))
+            os.replace(tmp_path, file_path)
+
+            self._written(file_path, len(data) if isinstance(data, list) else 1, True)
+            self._replace_field(exp_id, field, file_path)
 
         else:
             raise ValueError("Write mode is not enabled.")
@@ -153,24 +739,182 @@ class DiskStorage(Storage):
 
             existing_data = self.read(exp_id, field)
 
-            file_path = f"{self.base_dir}/{exp_id}/{field}.json"
-
             existing_data[key] = data
 
-            with open(file_path, "wb") as f:
-                f.write(orjson.dumps(existing_data))
+            self.write(exp_id, field, existing_data)
 
         else:
             raise ValueError("Write mode is not enabled.")
 
-    def iterable(self, exp_id: str, field: str):
+    def iterable(
+        self,
+        exp_id: str,
+        field: str,
+        fields: List[str] = None,
+        where=None,
+    ):
+        if self.is_read_mode():
+            if fields is not None or where is not None:
+                # filter and project while streaming, so unused elements and
+                # sub-objects are dropped one chunk at a time instead of being
+                # held for the whole field.
+                yield from select(
+                    self.iterable(exp_id, field), fields=fields, where=where
+                )
+                return
+
+            if len(self._segment_paths(exp_id, field)) > 0:
+                with self._field_lock(exp_id, field):
+                    yield from self._iter_field(exp_id, field, self._iter_file)
+            else:
+                yield from self._iter_file(self._field_path(exp_id, field))
+
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _record_offsets(self, file_path: str) -> array:
+        """
+        Boundaries of the complete records of a plain jsonl file.
+
+        The index is cached per file and extended when the file grows by
+        appends, so repeated samples only scan the new tail. Any other change
+        (a new inode, a shrink, a rewrite of the same size) rebuilds it.
+        """
+        stat = os.stat(file_path)
+        size = stat.st_size
+        version = (stat.st_ino, stat.st_mtime_ns, size)
+        cached_version, offsets = self._offsets.get(file_path, (None, None))
+
+        if cached_version == version:
+            return offsets
+        elif (
+            cached_version is None
+            or cached_version[0] != stat.st_ino
+            or cached_version[2] >= size
+        ):
+            offsets = array("Q", [0])
+
+        with mapped(file_path) as mm:
+            if offsets[-1] > 0 and mm[offsets[-1] - 1 : offsets[-1]] != b"\n":
+                # the indexed prefix no longer ends a record; not an append.
+                offsets = array("Q", [0])
+
+            pos = offsets[-1]
+            while True:
+                newline = mm.find(b"\n", pos, size)
+                if newline < 0:  # a trailing partial line is not indexed
+                    break
+
+                pos = newline + 1
+                if pos - offsets[-1] > 1:
+                    offsets.append(pos)
+                else:  # skip blank lines
+                    offsets[-1] = pos
+
+        self._offsets[file_path] = (version, offsets)
+        return offsets
+
+    def _count_file(self, file_path: str) -> int:
+        if file_path.endswith(".jsonl"):
+            return len(self._record_offsets(file_path)) - 1
+
+        with open_decompressed(file_path) as file:
+            if ".jsonl" in file_path:
+                return sum(
+                    chunk.count(b"\n")
+                    for chunk in iter(lambda: file.read(JSONL_CHUNK_SIZE), b"")
+                )
+            else:
+                return count_json_array(file, self.stream_decoder)
+
+    def count(self, exp_id: str, field: str) -> int:
+        if self.is_read_mode():
+            # plain jsonl is counted from its record index and compressed jsonl
+            # from newlines; JSON arrays are streamed through the decoder.
+            if len(self._segment_paths(exp_id, field)) > 0:
+                with self._field_lock(exp_id, field):
+                    return sum(
+                        self._iter_field(
+                            exp_id, field, lambda path: [self._count_file(path)]
+                        )
+                    )
+
+            return self._count_file(self._field_path(exp_id, field))
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def tail(self, exp_id: str, field: str, start: int):
+        if self.is_read_mode():
+            if start > 0 and len(self._segment_paths(exp_id, field)) == 0:
+                file_path = self._field_path(exp_id, field)
+
+                if file_path.endswith(".jsonl"):
+                    # seek past the skipped records instead of decoding them.
+                    offsets = self._record_offsets(file_path)
+                    yield from _iter_jsonl_from(
+                        file_path, offsets[min(start, len(offsets) - 1)]
+                    )
+                    return
+
+            yield from super().tail(exp_id, field, start)
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def sample(
+        self,
+        exp_id: str,
+        field: str,
+        k: int,
+        seed: int = None,
+        where=None,
+        fields: List[str] = None,
+    ) -> List[Any]:
+        if self.is_read_mode():
+            if where is not None or len(self._segment_paths(exp_id, field)) > 0:
+                return super().sample(exp_id, field, k, seed, where, fields)
+
+            file_path = self._field_path(exp_id, field)
+
+            if not file_path.endswith(".jsonl") or file_codec(file_path) is not None:
+                # json arrays and compressed files have no cheap record index.
+                return super().sample(exp_id, field, k, seed, where, fields)
+
+            offsets = self._record_offsets(file_path)
+            count = len(offsets) - 1
+            chosen = sorted(random.Random(seed).sample(range(count), min(k, count)))
+
+            with mapped(file_path) as mm:
+                elements = [orjson.loads(mm[offsets[i] : offsets[i + 1]]) for i in chosen]
+
+            return list(select(elements, fields=fields))
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def is_list(self, exp_id: str, field: str) -> bool:
         if self.is_read_mode():
-            file_path = f"{self.base_dir}/{exp_id}/{field}.json"
-            with open(file_path, "rb") as file:
-                # ijson.items() returns an iterator over the items in the array
-                for item in ijson.items(file, "item"):
-                    yield item
+            if len(self._segment_paths(exp_id, field)) > 0:
+                return True
+
+            file_path = self._field_path(exp_id, field)
+
+            if ".jsonl" in file_path:
+                return True
+
+            with open_decompressed(file_path) as file:
+                return file.read(64).lstrip()[:1] == b"["
+        else:
+            raise ValueError("Read mode is not enabled.")
 
+    def field_version(self, exp_id: str, field: str):
+        if self.is_read_mode():
+            stats = [
+                os.stat(file_path)
+                for file_path in self._iter_field(exp_id, field, lambda path: [path])
+            ]
+            return (
+                f"{sum(stat.st_size for stat in stats)}:"
+                f"{max(stat.st_mtime_ns for stat in stats)}"
+            )
         else:
             raise ValueError("Read mode is not enabled.")
 
@@ -180,6 +924,14 @@ class DiskStorage(Storage):
         field: str,
         data: Any,
     ):
+        self.extend_subfield(exp_id, field, [data])
+
+    def extend_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+    ):
 
         if self.is_write_mode():
 
@@ -187,12 +939,41 @@ class DiskStorage(Storage):
 
                 raise ValueError(f"Collection {exp_id} does not exist.")
 
-            file_path = f"{self.base_dir}/{exp_id}/{field}.json"
+            if len(data) == 0:
+                return
+
+            if self.writer is not None:
+                file_path = self._segment_path(exp_id, field)
+                created = self._durability is not None and not os.path.exists(file_path)
+
+                with self._field_lock(exp_id, field):
+                    append_lines(file_path, data)
+
+                self._written(file_path, len(data), created)
+                return
+
+            try:
+                file_path = self._field_path(exp_id, field)
+                created = False
+            except FileNotFoundError:
+                file_path = self._new_field_path(exp_id, field, True)
+                created = True
+
+            if ".jsonl" in file_path:
+                append_lines(file_path, data)
+                self._written(file_path, len(data), created)
+                return
+
+            if file_codec(file_path) is not None:
+                # a compressed JSON array cannot be patched in place.
+                return super().extend_subfield(exp_id, field, data)
+
+            payload = b",".join(orjson.dumps(d) for d in data)
 
             if not os.path.exists(file_path):
-                # If file doesn't exist, create it with an empty list and add the first element
+                # If file doesn't exist, create it with an empty list and add the elements
                 with open(file_path, "wb") as file:
-                    file.write(b"[" + orjson.dumps(data) + b"]")
+                    file.write(b"[" + payload + b"]")
             else:
                 # If file exists, append to the list while keeping the JSON valid
                 with open(file_path, "r+b") as file:
@@ -208,12 +989,101 @@ class DiskStorage(Storage):
                     ):  # File size is greater than 2 means it's not an empty list (just [])
                         file.write(b",")
 
-                    # Write the new instance and close the list with ']'
-                    file.write(orjson.dumps(data) + b"]")
+                    # Write the new instances and close the list with ']'
+                    file.write(payload + b"]")
+
+            self._written(file_path, len(data), created)
 
         else:
             raise ValueError("Write mode is not enabled.")
 
+    def convert(self, list_format: str = None, exp_ids: List[str] = None):
+        """
+        Rewrite existing fields in this storage's layout: `list_format` for list
+        fields (defaults to the storage's) and its compression for every field.
+
+        Fields are streamed into a temporary file which then replaces the old
+        one, so an interrupted conversion leaves every field readable.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        if list_format is not None and list_format not in LIST_FORMATS:
+            raise ValueError(f"Unknown list format {list_format}.")
+
+        for exp_id in self.keys() if exp_ids is None else exp_ids:
+            for field in self.fields(exp_id):
+                has_segments = len(self._segment_paths(exp_id, field)) > 0
+
+                if has_segments:
+                    file_path, is_list = None, True
+                else:
+                    file_path = self._field_path(exp_id, field)
+                    is_list = self.is_list(exp_id, field)
+
+                new_path = self._new_field_path(exp_id, field, is_list, list_format)
+
+                if new_path != file_path:
+                    self._rewrite(exp_id, field, new_path, is_list)
+
+    def compact(self, exp_ids: List[str] = None):
+        """
+        Fold the writer segments of every list field back into the field file.
+
+        Segment writers are blocked while a field is being compacted.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        for exp_id in self.keys() if exp_ids is None else exp_ids:
+            for field in self.fields(exp_id):
+                if len(self._segment_paths(exp_id, field)) > 0:
+                    new_path = self._new_field_path(exp_id, field, True)
+                    self._rewrite(exp_id, field, new_path, True)
+
+    def _rewrite(self, exp_id: str, field: str, new_path: str, is_list: bool):
+        # stream the field into a temporary file which then replaces the old
+        # files, so an interruption leaves the field readable.
+        tmp_path = f"{self._dir_path(exp_id)}/.{field}.tmp"
+
+        if len(self._segment_paths(exp_id, field)) > 0:
+            lock = self._field_lock(exp_id, field, exclusive=True)
+        else:
+            lock = nullcontext()
+
+        with lock:
+            try:
+                with open(tmp_path, "wb") as f:
+                    if not is_list:
+                        data = self._read_file(self._field_path(exp_id, field))
+                        payload = orjson.dumps(data)
+                        f.write(compress_frame(self.compression, payload))
+
+                    elif ".jsonl" in new_path:
+                        for chunk in chunked_iterable(
+                            self._iter_field(exp_id, field, self._iter_file), 1000
+                        ):
+                            payload = b"".join(orjson.dumps(d) + b"\n" for d in chunk)
+                            f.write(compress_frame(self.compression, payload))
+
+                    else:
+                        f.write(b"[")
+                        elements = self._iter_field(exp_id, field, self._iter_file)
+                        for i, item in enumerate(elements):
+                            f.write((b"," if i > 0 else b"") + orjson.dumps(item))
+                        f.write(b"]")
+
+                os.replace(tmp_path, new_path)
+            finally:
+                # a failed rewrite leaves the old files and no partial copy.
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            self._written(new_path, 0, True)
+            self._replace_field(exp_id, field, new_path)
+
 
 class CachedRODiskStorage(CachedRO):
     def __init__(self, base_dir: str):
@@ -0,0 +1,135 @@
+import os
+import threading
+import weakref
+from typing import Union
+
+
+def fsync_path(path: str, directory: bool = False):
+    fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _commit_periodically(ref, stop: threading.Event, interval_ms: float):
+    # holds the group commit weakly, so an unclosed one can still be collected.
+    while not stop.wait(interval_ms / 1000):
+        group = ref()
+        if group is None:
+            return
+        group.commit()
+        del group
+
+
+class GroupCommit:
+    """
+    Batches fsyncs of the files written by a storage.
+
+    Writers report what they wrote through `written`; dirty files are synced
+    once `records` records were written since the last sync, every
+    `interval_ms` milliseconds (from a background thread) and on `close`.
+    Without `records` and `interval_ms` files are only synced on close.
+
+    Syncs are group commits: one sync covers every write reported before it
+    started, so concurrent writers that cross the threshold together share a
+    single fsync per file instead of issuing one each.
+
+    Copies and pickles start with nothing to sync and their own thread; the
+    original still syncs what was written through it.
+    """
+
+    def __init__(self, records: int = None, interval_ms: float = None):
+        self.records = records
+        self.interval_ms = interval_ms
+
+        self._lock = threading.Lock()  # guards the dirty sets
+        self._sync_lock = threading.Lock()  # one sync round at a time
+        self._files = set()
+        self._dirs = set()
+        self._pending = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        if interval_ms is not None:
+            self._thread = threading.Thread(
+                target=_commit_periodically,
+                args=(weakref.ref(self), self._stop, interval_ms),
+                daemon=True,
+            )
+            self._thread.start()
+            weakref.finalize(self, self._stop.set)
+
+    def __getstate__(self):
+        return {"records": self.records, "interval_ms": self.interval_ms}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def created(self, path: str):
+        """Report a new file or directory at `path`, so its parent is synced."""
+        with self._lock:
+            self._dirs.add(os.path.dirname(path))
+
+    def written(self, path: str, records: int = 1, created: bool = False):
+        """Report `records` written to `path`; `created` if the file is new."""
+        with self._lock:
+            self._files.add(path)
+            if created:
+                # the new directory entry must be synced too.
+                self._dirs.add(os.path.dirname(path))
+            self._pending += records
+            due = self.records is not None and self._pending >= self.records
+
+        if due:
+            self.commit()
+
+    def commit(self):
+        """Sync every file written so far."""
+        with self._sync_lock:
+            with self._lock:
+                files, self._files = self._files, set()
+                dirs, self._dirs = self._dirs, set()
+                self._pending = 0
+
+            for path in files:
+                try:
+                    fsync_path(path)
+                except FileNotFoundError:  # replaced or deleted since
+                    pass
+
+            for path in dirs:
+                try:
+                    fsync_path(path, directory=True)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+        self.commit()
+
+
+def make_durability(policy: Union[str, GroupCommit, None]) -> GroupCommit:
+    """
+    Build the group commit of a durability policy.
+
+    `policy` is "none" (never sync), "close" (sync on close), a dict of
+    `GroupCommit` arguments, e.g. {"records": 1000} or {"interval_ms": 200},
+    or a `GroupCommit`.
+    """
+    if policy is None or policy == "none":
+        return None
+    elif policy == "close":
+        return GroupCommit()
+    elif isinstance(policy, dict):
+        return GroupCommit(**policy)
+    elif isinstance(policy, GroupCommit):
+        return policy
+    else:
+        raise ValueError(f"Unknown durability policy {policy}.")
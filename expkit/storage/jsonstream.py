@@ -0,0 +1,160 @@
+from functools import lru_cache
+from typing import Any, Iterator
+
+import ijson
+import orjson
+
+STREAM_CHUNK_SIZE = 1 << 22  # 4MB
+
+IJSON_BACKENDS = ("yajl2_c", "yajl2_cffi", "yajl2", "python")
+
+_BACKSLASH, _COMMA = ord("\\"), ord(",")
+_ARRAY_OPEN, _OBJECT_OPEN = ord("["), ord("{")
+_ARRAY_CLOSE, _OBJECT_CLOSE = ord("]"), ord("}")
+
+
+@lru_cache(maxsize=None)
+def ijson_backend():
+    """Fastest ijson backend available (the C one is often not installed)."""
+    for name in IJSON_BACKENDS:
+        try:
+            return ijson.get_backend(name)
+        except ImportError:
+            continue
+
+    return ijson
+
+
+def array_spans(file, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Scan a top-level JSON array and yield `(buffer, start, end)` spans.
+
+    `buffer[start:end]` holds one or more complete, comma-separated elements.
+    Elements are located without being decoded: strings are skipped with
+    `find`, and stretches between strings that stay nested inside an element
+    only update the depth through `count`, so python code runs per string
+    rather than per byte. The buffer only ever holds one chunk plus the element
+    being read. Yields nothing if the document is not an array.
+    """
+
+    buf = bytearray()
+    pos = 0  # next position to scan
+    start = None  # first element not yet yielded
+    end = None  # end of the last complete element
+    depth = 0
+    in_string = False
+
+    while True:
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        size = len(buf)
+
+        while pos < size:
+            quote = buf.find(b'"', pos)
+
+            if in_string:
+                if quote < 0:
+                    pos = size
+                    break
+
+                escape = quote - 1
+                while buf[escape] == _BACKSLASH:
+                    escape -= 1
+
+                in_string = (quote - 1 - escape) % 2 == 1
+                pos = quote + 1
+                continue
+
+            stop = size if quote < 0 else quote
+
+            closes = buf.count(b"]", pos, stop) + buf.count(b"}", pos, stop)
+
+            if depth - closes >= 2:
+                # stays inside the current element.
+                depth += buf.count(b"[", pos, stop) + buf.count(b"{", pos, stop)
+                depth -= closes
+            else:
+                for i in range(pos, stop):
+                    token = buf[i]
+
+                    if token == _ARRAY_OPEN or token == _OBJECT_OPEN:
+                        if depth == 0:
+                            if token != _ARRAY_OPEN:
+                                return
+                            start = i + 1
+                        depth += 1
+                    elif token == _ARRAY_CLOSE or token == _OBJECT_CLOSE:
+                        depth -= 1
+                        if depth == 0:
+                            if buf[start:i].strip():
+                                yield buf, start, i
+                            return
+                    elif token == _COMMA and depth == 1:
+                        end = i
+
+            pos = stop
+            if quote >= 0:
+                in_string = True
+                pos = quote + 1
+
+        if eof:
+            if start is None:  # empty or scalar document
+                return
+            raise ValueError("Incomplete JSON array.")
+
+        if end is not None and end > start:
+            yield buf, start, end
+            # keep only the element being read.
+            del buf[: end + 1]
+            pos -= end + 1
+            start, end = 0, None
+
+
+def iter_orjson_array(file, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Stream the elements of a top-level JSON array.
+
+    Element boundaries are found by `array_spans` and all complete elements of
+    a chunk are decoded with a single `orjson.loads` call.
+    """
+
+    for buf, start, end in array_spans(file, chunk_size):
+        yield from orjson.loads(b"[" + bytes(buf[start:end]) + b"]")
+
+
+def count_json_array(file, decoder: str = "auto") -> int:
+    """
+    Number of elements of a top-level JSON array, in bounded memory.
+
+    The elements are decoded one by one and dropped. Locating them with
+    `array_spans` alone would avoid building them, but its python scan is
+    about three times slower than ijson's C backend decoding them, so
+    `decoder="auto"` counts with that backend when it is installed.
+    """
+    if decoder == "auto" and ijson_backend().backend_name == "yajl2_c":
+        decoder = "ijson"
+
+    return sum(1 for _ in iter_json_array(file, decoder))
+
+
+def ijson_items(file, prefix: str = "item") -> Iterator[Any]:
+    # floats as float, like orjson; ijson defaults to Decimal.
+    return ijson_backend().items(file, prefix, use_float=True)
+
+
+def iter_json_array(file, decoder: str = "auto") -> Iterator[Any]:
+    """
+    Stream the elements of a top-level JSON array.
+
+    `decoder="auto"` and "orjson" use the orjson chunk decoder; "ijson" uses
+    the fastest ijson backend instead (e.g. for single elements too large to
+    hold twice in memory). Both decode floats as `float`.
+    """
+
+    if decoder == "ijson":
+        return ijson_items(file, "item")
+    elif decoder in ("auto", "orjson"):
+        return iter_orjson_array(file)
+    else:
+        raise ValueError(f"Unknown decoder {decoder}.")
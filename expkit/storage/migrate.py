@@ -0,0 +1,442 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
+
+import orjson
+from tqdm import tqdm
+
+from expkit.storage.base import Storage, StorageDocument, chunked_iterable
+
+
+def copy_field(
+    source: Storage,
+    target: Storage,
+    exp_id: str,
+    field: str,
+    chunk_size: int = 1000,
+) -> Tuple[int, int]:
+    """
+    Copy a single field between storages.
+
+    List fields are streamed through `iterable` and written with batched
+    appends, so at most `chunk_size` elements are held in memory. Sources
+    without their own `is_list` (which reads the whole field) are read once
+    instead. Bytes are counted as the JSON size of each value or chunk.
+
+    Returns:
+        (records, bytes) copied.
+    """
+
+    if type(source).is_list is Storage.is_list:
+        data = source.read(exp_id, field)
+        elements = data if isinstance(data, list) else None
+    elif source.is_list(exp_id, field):
+        elements = source.iterable(exp_id, field)
+    else:
+        data, elements = source.read(exp_id, field), None
+
+    if elements is None:
+        target.write(exp_id, field, data)
+        return 1, len(orjson.dumps(data))
+
+    target.write(exp_id, field, [])
+
+    records, size = 0, 0
+    for chunk in chunked_iterable(elements, chunk_size):
+        target.extend_subfield(exp_id, field, chunk)
+        records += len(chunk)
+        size += len(orjson.dumps(chunk))
+
+    return records, size
+
+
+def copy_document(
+    document: StorageDocument,
+    storage: Storage,
+    chunk_size: int = 1000,
+    **kwargs,
+):
+    """
+    Copy a document into `storage`, creating it with `kwargs`.
+
+    Returns:
+        (new document, records, bytes) copied.
+    """
+    exp_id = document.id()
+    source = document.storage()
+
+    new_document = storage.create(exp_id=exp_id, **kwargs)
+
+    records, size = 0, 0
+    for field in document.keys():
+        r, s = copy_field(source, storage, exp_id, field, chunk_size=chunk_size)
+        records += r
+        size += s
+
+    return new_document, records, size
+
+
+class Migration:
+    """
+    Copies every document of a storage into another one.
+
+    Documents are copied concurrently by `workers` threads. When a `journal`
+    path is given, finished documents are recorded there (one id per line) and
+    skipped on the next run, so an interrupted migration resumes where it
+    stopped. Documents that were only partially copied are rewritten.
+    """
+
+    def __init__(
+        self,
+        source: Storage,
+        target: Storage,
+        workers: int = 1,
+        chunk_size: int = 1000,
+        journal: str = None,
+        **kwargs,
+    ):
+        self.source = source
+        self.target = target
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.journal = journal
+
+        if journal is not None and not kwargs.get("force", False):
+            kwargs.setdefault("exists_ok", True)
+
+        self.create_kwargs = kwargs
+
+        self._lock = threading.Lock()
+
+    def completed(self) -> set:
+        if self.journal is None or not os.path.exists(self.journal):
+            return set()
+
+        with open(self.journal, "r") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _record(self, exp_id: str):
+        if self.journal is None:
+            return
+
+        with self._lock:
+            with open(self.journal, "a") as f:
+                f.write(exp_id + "\n")
+
+    def _copy(self, exp_id: str):
+        _, records, size = copy_document(
+            self.source.document(exp_id),
+            self.target,
+            chunk_size=self.chunk_size,
+            **self.create_kwargs,
+        )
+        self.target.flush(exp_id)
+        self._record(exp_id)
+
+        return records, size
+
+    def run(self) -> Dict[str, Any]:
+        done = self.completed()
+        pending = [exp_id for exp_id in self.source.keys() if exp_id not in done]
+
+        stats = {
+            "documents": 0,
+            "skipped": len(done),
+            "records": 0,
+            "bytes": 0,
+            "failed": [],
+        }
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            futures = {pool.submit(self._copy, exp_id): exp_id for exp_id in pending}
+
+            progress = tqdm(as_completed(futures), total=len(futures))
+            for future in progress:
+                exp_id = futures[future]
+                try:
+                    records, size = future.result()
+                except Exception as e:
+                    print(f"Failed to copy {exp_id}: {e}")
+                    stats["failed"].append(exp_id)
+                    continue
+
+                stats["documents"] += 1
+                stats["records"] += records
+                stats["bytes"] += size
+
+                elapsed = max(time.perf_counter() - start, 1e-9)
+                progress.set_postfix(
+                    recps=f"{stats['records'] / elapsed:.0f}",
+                    MBps=f"{stats['bytes'] / elapsed / 1e6:.1f}",
+                )
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["records_per_s"] = stats["records"] / max(stats["seconds"], 1e-9)
+        stats["bytes_per_s"] = stats["bytes"] / max(stats["seconds"], 1e-9)
+
+        if len(stats["failed"]) > 0:
+            raise RuntimeError(
+                f"Failed to copy {len(stats['failed'])} documents: {stats['failed']}"
+            )
+
+        return stats
+
+
+def _element_digest(digest, element: Any):
+    digest.update(orjson.dumps(element, option=orjson.OPT_SORT_KEYS))
+    digest.update(b"\n")
+
+
+def _digest(element: Any) -> str:
+    digest = hashlib.sha1()
+    _element_digest(digest, element)
+    return digest.hexdigest()
+
+
+class Sync:
+    """
+    Incrementally mirrors a storage into another one.
+
+    A `state` file remembers, per document and field, the source version stamp
+    (see `Storage.field_version`) and, for list fields, a resume point: the
+    number of elements copied, a digest of the last one and the target's
+    version stamp. Fields whose stamp did not change are skipped. A list field
+    whose target is still at its resume point gets the source elements from
+    there on (see `Storage.tail`), after checking that the element before
+    them is unchanged; the copied prefix itself is not read again. Anything
+    else is rewritten.
+
+    Without a resume point, or when the target changed since (a run that
+    failed or was killed mid-document, another writer), the target is used as
+    the reference: both sides are read in full and compared before anything
+    is appended. Targets without version stamps are checked by `count`.
+    """
+
+    def __init__(
+        self,
+        source: Storage,
+        target: Storage,
+        state: str = None,
+        workers: int = 1,
+        chunk_size: int = 1000,
+    ):
+        self.source = source
+        self.target = target
+        self.state_path = state
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+        self.state = {}
+        if state is not None and os.path.exists(state):
+            with open(state, "r") as f:
+                self.state = json.load(f)
+
+        self._lock = threading.Lock()
+
+    def save_state(self):
+        if self.state_path is None:
+            return
+
+        tmp_path = f"{self.state_path}.tmp"
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def _target_count(self, exp_id: str, field: str) -> int:
+        try:
+            if field not in self.target.fields(exp_id):
+                return 0
+            if not self.target.is_list(exp_id, field):
+                return 1
+            return self.target.count(exp_id, field)
+        except (KeyError, FileNotFoundError):
+            return 0
+
+    def _target_version(self, exp_id: str, field: str):
+        try:
+            return self.target.field_version(exp_id, field)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def _at_resume_point(self, exp_id: str, field: str, previous: Dict[str, Any]):
+        # whether the target still holds exactly what the state says was copied.
+        if "last" not in previous:
+            return False
+
+        version = self._target_version(exp_id, field)
+        if version is not None:
+            return version == previous.get("target_version")
+
+        return self._target_count(exp_id, field) == previous["count"]
+
+    def _target_reference(self, exp_id: str, field: str) -> Dict[str, Any]:
+        digest = hashlib.sha1()
+        count = 0
+
+        try:
+            if field in self.target.fields(exp_id):
+                if not self.target.is_list(exp_id, field):
+                    _element_digest(digest, self.target.read(exp_id, field))
+                    return {"count": 1, "digest": digest.hexdigest()}
+
+                for element in self.target.iterable(exp_id, field):
+                    _element_digest(digest, element)
+                    count += 1
+        except (KeyError, FileNotFoundError):
+            pass
+
+        return {"count": count, "digest": digest.hexdigest()}
+
+    def _append(self, exp_id: str, field: str, elements, count: int, last: str):
+        # copy `elements` after the `count` already in the target.
+        records = 0
+        for chunk in chunked_iterable(elements, self.chunk_size):
+            self.target.extend_subfield(exp_id, field, chunk)
+            last = _digest(chunk[-1])
+            records += len(chunk)
+
+        return {"count": count + records, "last": last}, records
+
+    def _resume_list(self, exp_id: str, field: str, previous: Dict[str, Any]):
+        count = previous["count"]
+        if count == 0:
+            return self._append(
+                exp_id, field, self.source.iterable(exp_id, field), 0, None
+            )
+
+        # the element before the new ones has to be the last one copied.
+        elements = iter(self.source.tail(exp_id, field, count - 1))
+        for element in itertools.islice(elements, 1):
+            if _digest(element) == previous["last"]:
+                return self._append(exp_id, field, elements, count, previous["last"])
+
+        # the list shrank or its copied part changed.
+        return None
+
+    def _sync_list(self, exp_id: str, field: str, previous: Dict[str, Any]):
+        digest = hashlib.sha1()
+        prefix_count = previous["count"]
+
+        elements = iter(self.source.iterable(exp_id, field))
+
+        count, last = 0, None
+        for element in elements:
+            if count == prefix_count:
+                elements = itertools.chain([element], elements)
+                break
+            _element_digest(digest, element)
+            count += 1
+            last = element
+
+        if count < prefix_count or digest.hexdigest() != previous["digest"]:
+            # the copied prefix changed; rewrite the whole field.
+            self.target.write(exp_id, field, [])
+            count, last = 0, None
+            elements = self.source.iterable(exp_id, field)
+
+        return self._append(
+            exp_id, field, elements, count, None if count == 0 else _digest(last)
+        )
+
+    def _sync_value(self, exp_id: str, field: str, previous: Dict[str, Any]):
+        data = self.source.read(exp_id, field)
+
+        digest = hashlib.sha1()
+        _element_digest(digest, data)
+
+        if digest.hexdigest() == previous["digest"]:
+            return previous, 0
+
+        self.target.write(exp_id, field, data)
+        return {"count": 1, "digest": digest.hexdigest()}, 1
+
+    def _sync_document(self, exp_id: str):
+        with self._lock:
+            document_state = dict(self.state.get(exp_id, {}))
+
+        if not self.target.exists(exp_id):
+            self.target.create(exp_id)
+            document_state = {}
+
+        records = 0
+        for field in self.source.fields(exp_id):
+            version = self.source.field_version(exp_id, field)
+            previous = document_state.get(field)
+
+            if (
+                previous is not None
+                and version is not None
+                and previous["version"] == version
+            ):
+                continue
+
+            if not self.source.is_list(exp_id, field):
+                if previous is None:
+                    previous = self._target_reference(exp_id, field)
+                field_state, r = self._sync_value(exp_id, field, previous)
+
+            else:
+                resumed = None
+                if previous is not None and self._at_resume_point(
+                    exp_id, field, previous
+                ):
+                    resumed = self._resume_list(exp_id, field, previous)
+
+                if resumed is None:
+                    reference = self._target_reference(exp_id, field)
+                    resumed = self._sync_list(exp_id, field, reference)
+
+                field_state, r = resumed
+                field_state["target_version"] = self._target_version(exp_id, field)
+
+            document_state[field] = {"version": version, **field_state}
+            records += r
+
+        self.target.flush(exp_id)
+        with self._lock:
+            self.state[exp_id] = document_state
+
+        return records
+
+    def run(self) -> Dict[str, Any]:
+        stats = {"documents": 0, "records": 0, "failed": []}
+        start = time.perf_counter()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+                futures = {
+                    pool.submit(self._sync_document, exp_id): exp_id
+                    for exp_id in self.source.keys()
+                }
+
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    exp_id = futures[future]
+                    try:
+                        records = future.result()
+                    except Exception as e:
+                        print(f"Failed to sync {exp_id}: {e}")
+                        stats["failed"].append(exp_id)
+                        continue
+
+                    stats["documents"] += 1
+                    stats["records"] += records
+
+                    self.save_state()
+        finally:
+            self.save_state()
+
+        stats["seconds"] = time.perf_counter() - start
+
+        if len(stats["failed"]) > 0:
+            raise RuntimeError(
+                f"Failed to sync {len(stats['failed'])} documents: {stats['failed']}"
+            )
+
+        return stats
@@ -12,14 +12,166 @@ from concurrent.futures import (
 )
 import orjson
 import motor.motor_asyncio
-from pymongo import WriteConcern
-import asyncio
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne, WriteConcern
 from types import MappingProxyType
 import itertools
+import threading
+import uuid
 import ijson
+import bson
 
 
-from expkit.storage.base import Storage
+from expkit.storage.base import (
+    Storage,
+    LIST_SYM,
+    chunked_iterable,
+    meta_matches,
+    projection_tree,
+    select,
+)
+
+
+# documents record their layout under LAYOUT_KEY. "native" documents keep lists
+# as BSON arrays; documents without the key are from before and keep lists as
+# dicts with ">>i" keys (see `MongoStorage.upgrade_layout`).
+LAYOUT_KEY = "_layout"
+NATIVE = "native"
+LEGACY = "keys"
+
+
+# meta keys indexed by default for `find`.
+CATALOG_INDEXES = ("dataset", "model_path", "variant")
+
+# encoded elements per update; half the 16 MB limit leaves room for the paths.
+MAX_UPDATE_BYTES = 8 * 1024 * 1024
+
+
+def sized_batches(elements: List[Any], batch_size: int, max_bytes: int = None):
+    """Batches of at most `batch_size` elements and about `max_bytes` of BSON."""
+    max_bytes = MAX_UPDATE_BYTES if max_bytes is None else max_bytes
+
+    batch, size = [], 0
+    for element in elements:
+        n = len(bson.encode({"v": element}))
+        if len(batch) > 0 and (len(batch) == batch_size or size + n > max_bytes):
+            yield batch
+            batch, size = [], 0
+
+        batch.append(element)
+        size += n
+
+    if len(batch) > 0:
+        yield batch
+
+
+def pushdown_match(where) -> dict:
+    """Conditions of a `where` dict that the server can evaluate exactly."""
+    if where is None or callable(where):
+        return {}
+
+    return {
+        path: value
+        for path, value in where.items()
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool)
+    }
+
+
+def catalog_query(criteria) -> dict:
+    """Filter on documents with a "meta" field for the exact `find` criteria."""
+    return {
+        "_id" if k == "name" else f"meta.{k}": v
+        for k, v in pushdown_match(criteria).items()
+    }
+
+
+def reduce_stages(
+    element: str,
+    index: str,
+    entry_key: str,
+    reduce: str,
+    experiment_reduce: str = None,
+    n: int = None,
+) -> List[dict]:
+    """
+    Pipeline stages of `Storage.reduce` over one document per element.
+
+    They only stand in for the numpy reductions where both agree: booleans
+    count as 1/0 (Mongo accumulators skip them), and an element whose entry is
+    missing, empty, not an array or holds non-numbers is flagged, so `reduced`
+    leaves it to the client instead of returning null. A negative `n` slices
+    from the end in Mongo but not in Python, so it is not pushed down.
+    """
+    if n is not None and n < 0:
+        raise NotImplementedError
+
+    values = f"{element}.{entry_key}"
+    array = {"$isArray": values}
+    if n is not None:
+        values = {"$slice": [values, n]}
+
+    number = {"$or": [{"$isNumber": "$x"}, {"$in": ["$x", [True, False]]}]}
+
+    stages = [
+        {"$project": {"_id": 0, "i": index, "x": {"$cond": [array, values, None]}}},
+        {"$sort": {"i": 1}},
+        # empty or missing entries keep one document without x.
+        {"$unwind": {"path": "$x", "preserveNullAndEmptyArrays": True}},
+        {
+            "$project": {
+                "i": 1,
+                "x": {
+                    "$cond": [
+                        {"$eq": ["$x", True]},
+                        1,
+                        {"$cond": [{"$eq": ["$x", False]}, 0, "$x"]},
+                    ]
+                },
+                "ok": {"$cond": [number, 1, 0]},
+            }
+        },
+        {"$group": {"_id": "$i", "v": {reduce: "$x"}, "ok": {"$min": "$ok"}}},
+        {"$sort": {"_id": 1}},
+    ]
+    if experiment_reduce is not None:
+        stages.append(
+            {
+                "$group": {
+                    "_id": None,
+                    "v": {experiment_reduce: "$v"},
+                    "ok": {"$min": "$ok"},
+                }
+            }
+        )
+
+    return stages
+
+
+def reduced(documents, experiment_reduce: str = None):
+    documents = list(documents)
+    if len(documents) == 0 or not all(d["ok"] for d in documents):
+        # empty, missing or non-numeric entries; leave them to the client.
+        raise NotImplementedError
+
+    values = [d["v"] for d in documents]
+    return values if experiment_reduce is None else values[0]
+
+
+def server_projection(fields: List[str], where) -> dict:
+    """Projection tree to push down; it keeps the paths `where` looks at."""
+    if fields is None or callable(where):
+        return None
+
+    return projection_tree(list(fields) + list((where or {}).keys()))
+
+
+def encode_mongo_format(data):
+    """Inverse of `decode_mongo_format`: lists become dicts with ">>i" keys."""
+    if isinstance(data, dict):
+        return {k: encode_mongo_format(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return {f"{LIST_SYM}{i}": encode_mongo_format(v) for i, v in enumerate(data)}
+    else:
+        return data
 
 
 def decode_mongo_format(data):
@@ -54,16 +206,6 @@ def decode_mongo_format(data):
     return data
 
 
-def chunked_iterable(iterable, size):
-    """Helper function to split iterable into chunks of given size."""
-    it = iter(iterable)
-    while True:
-        chunk = list(itertools.islice(it, size))
-        if not chunk:
-            break
-        yield chunk
-
-
 class MongoStorage(Storage):
     # data structure
     # run_id : {meta: {key: value}, evals: {key: [ {key:value}] }, data: {input: { key:value}, outputs: [ { key:value}] }
@@ -73,35 +215,115 @@ class MongoStorage(Storage):
         uri: str,
         mode: str = "r",  # can be w, r, and rw
         database_name: str = "test3",
+        write_concern: dict = None,
+        catalog: str = "_catalog",
+        catalog_indexes: List[str] = CATALOG_INDEXES,
     ):
         super().__init__(mode)
         self.uri = uri
         self.client = pymongo.MongoClient(uri)
         self.db = self.client.get_database(database_name)
 
+        # acknowledged writes by default, so failures are raised.
+        self.write_concern = WriteConcern(**(write_concern or {"w": 1}))
+
+        # {_id: exp_id, meta} of every experiment, kept in sync by meta writes.
+        self.catalog = self.db.get_collection(catalog, write_concern=self.write_concern)
+        self.catalog_indexes = catalog_indexes
+        self._catalog_ready = False
+
         self.async_client = motor.motor_asyncio.AsyncIOMotorClient(uri)
 
         self.async_db = self.async_client.get_database(database_name)
 
+        # collections known to exist; misses are checked against the server.
+        self._collections = set()
+        self._layouts = {}
+        self._collections_lock = threading.Lock()
+
+    def _layout(self, exp_id: str) -> str:
+        layout = self._layouts.get(exp_id)
+
+        if layout is None:
+            document = self.db[exp_id].find_one({}, {LAYOUT_KEY: 1})
+            if document is None:
+                raise KeyError(exp_id)
+
+            layout = document.get(LAYOUT_KEY, LEGACY)
+            with self._collections_lock:
+                self._layouts[exp_id] = layout
+
+        return layout
+
+    @staticmethod
+    def _decode(document: dict, field: str = None):
+        # only legacy documents need their ">>i" dicts turned back into lists;
+        # the caller's document is left untouched.
+        native = document.get(LAYOUT_KEY, LEGACY) == NATIVE
+        if field is None:
+            value = {k: v for k, v in document.items() if k != LAYOUT_KEY}
+        else:
+            value = document[field]
+
+        return value if native else decode_mongo_format(deepcopy(value))
+
     def get(self, exp_id: str):
         if self.is_read_mode():
-            return decode_mongo_format(list(self.db[exp_id].find())[0])
+            document = self.db[exp_id].find_one()
+            if document is None:
+                raise KeyError(exp_id)
+
+            return self._decode(document)
 
     def delete(self, exp_id: str):
         if self.is_write_mode():
             self.db.drop_collection(exp_id)
+            with self._collections_lock:
+                self._collections.discard(exp_id)
+                self._layouts.pop(exp_id, None)
+
+            if self._has_catalog():
+                self.catalog.delete_one({"_id": exp_id})
         else:
             raise ValueError("Write mode is not enabled.")
 
     def keys(self):
         if self.is_read_mode():
-            return self.db.list_collection_names()
+            names = [
+                name
+                for name in self.db.list_collection_names()
+                if name != self.catalog.name
+            ]
+            with self._collections_lock:
+                self._collections = set(names)
+            return names
         else:
             raise ValueError("Read mode is not enabled.")
 
+    def invalidate(self, exp_id: str = None):
+        """
+        Forget cached collection names and layouts (only `exp_id`, if given).
+        Needed when collections are dropped or upgraded by another process.
+        """
+        with self._collections_lock:
+            if exp_id is None:
+                self._collections = set()
+                self._layouts = {}
+            else:
+                self._collections.discard(exp_id)
+                self._layouts.pop(exp_id, None)
+
     def exists(self, exp_id: str):
         if self.is_read_mode():
-            return exp_id in self.db.list_collection_names()
+            if exp_id in self._collections:
+                return True
+
+            # check this name only, instead of listing every collection.
+            found = len(self.db.list_collection_names(filter={"name": exp_id})) > 0
+            if found:
+                with self._collections_lock:
+                    self._collections.add(exp_id)
+            return found
         else:
 
             raise ValueError("Read mode is not enabled.")
@@ -127,11 +349,15 @@ class MongoStorage(Storage):
             collection.insert_one(
                 {
                     "_id": exp_id,
+                    LAYOUT_KEY: NATIVE,
                     # "meta": {},
                     # "evals": {},
                     # "data": {},
                 }
             )
+            with self._collections_lock:
+                self._collections.add(exp_id)
+                self._layouts[exp_id] = NATIVE
 
             return self.document(exp_id)
         else:
@@ -140,10 +366,313 @@ class MongoStorage(Storage):
     def read(self, exp_id: str, field: str):
         collection = self.db[exp_id]
         if self.is_read_mode():
-            return decode_mongo_format(collection.find_one({}, {field: 1})[field])
+            document = collection.find_one({}, {field: 1, LAYOUT_KEY: 1})
+            if document is None:
+                raise KeyError(exp_id)
+
+            return self._decode(document, field)
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _elements(
+        self,
+        exp_id: str,
+        field: str,
+        tree: dict = None,
+        match: dict = None,
+        size: int = None,
+    ):
+        # unwinding the list lets the filter, the sample and the top-level keys
+        # of the projection run in the server; the index restores the order.
+        if self._layout(exp_id) == NATIVE:
+            pipeline = [
+                {"$project": {"_id": 0, "e": f"${field}"}},
+                {"$unwind": {"path": "$e", "includeArrayIndex": "i"}},
+            ]
+        else:
+            # legacy ">>i" keys; paths never cross arrays, lists are dicts too.
+            pipeline = [
+                {"$project": {"_id": 0, "e": {"$objectToArray": f"${field}"}}},
+                {"$unwind": "$e"},
+                {"$project": {"e": "$e.v", "i": "$e.k"}},
+            ]
+
+        if match:
+            pipeline.append({"$match": {f"e.{k}": v for k, v in match.items()}})
+
+        if size is not None:
+            pipeline.append({"$sample": {"size": size}})
+
+        pipeline.append(
+            {
+                "$project": {
+                    "i": 1,
+                    "v": {key: f"$e.{key}" for key in tree} if tree else "$e",
+                }
+            }
+        )
+
+        if self._layout(exp_id) == NATIVE:
+            elements = sorted(self.db[exp_id].aggregate(pipeline), key=lambda e: e["i"])
+            return [e["v"] for e in elements]
+        else:
+            elements = sorted(
+                self.db[exp_id].aggregate(pipeline),
+                key=lambda e: int(e["i"].replace(LIST_SYM, "")),
+            )
+            return [decode_mongo_format(e["v"]) for e in elements]
+
+    def iterable(
+        self,
+        exp_id: str,
+        field: str,
+        fields: List[str] = None,
+        where=None,
+    ):
+        if fields is None and where is None:
+            return super().iterable(exp_id, field)
+
+        if self.is_read_mode():
+            elements = self._elements(
+                exp_id,
+                field,
+                tree=server_projection(fields, where),
+                match=pushdown_match(where),
+            )
+            # the server side filter is a superset; refine it client side.
+            return select(elements, fields=fields, where=where)
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def count(self, exp_id: str, field: str) -> int:
+        if self.is_read_mode():
+            # counts in the server, without sending the elements.
+            if self._layout(exp_id) == NATIVE:
+                size = {
+                    "$cond": [
+                        {"$isArray": f"${field}"},
+                        {"$size": f"${field}"},
+                        None,
+                    ]
+                }
+            else:
+                size = {"$size": {"$objectToArray": f"${field}"}}
+
+            document = next(
+                self.db[exp_id].aggregate(
+                    [
+                        {"$match": {field: {"$exists": True}}},
+                        {"$project": {"n": size}},
+                    ]
+                ),
+                None,
+            )
+            if document is None:
+                raise KeyError(field)
+            elif document["n"] is None:
+                raise ValueError(f"Field:{field} is not a list.")
+
+            return document["n"]
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def sample(
+        self,
+        exp_id: str,
+        field: str,
+        k: int,
+        seed: int = None,
+        where=None,
+        fields: List[str] = None,
+    ):
+        match = pushdown_match(where)
+
+        # $sample is not seedable and cannot apply python predicates.
+        if seed is not None or callable(where) or len(match) < len(where or {}):
+            return super().sample(exp_id, field, k, seed, where, fields)
+
+        if self.is_read_mode():
+            elements = self._elements(
+                exp_id,
+                field,
+                tree=server_projection(fields, where),
+                match=match,
+                size=k,
+            )
+            return list(select(elements, fields=fields, where=where))
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _has_catalog(self) -> bool:
+        if not self._catalog_ready:
+            names = self.db.list_collection_names(filter={"name": self.catalog.name})
+            self._catalog_ready = len(names) > 0
+
+        return self._catalog_ready
+
+    def _catalog_metas(self, metas: dict):
+        requests = [
+            ReplaceOne({"_id": exp_id}, {"_id": exp_id, "meta": meta}, upsert=True)
+            for exp_id, meta in metas.items()
+        ]
+        for batch in chunked_iterable(requests, 1000):
+            self.catalog.bulk_write(batch, ordered=False)
+
+    def build_catalog(self) -> int:
+        """
+        (Re)index the meta of every experiment in the catalog collection.
+
+        Meta writes keep the catalog up to date once it exists; the first one
+        builds it, so databases written before the catalog are indexed too.
+        Run this after metas were rewritten by code that bypasses the catalog
+        (e.g. older expkit versions), and `reconcile` after experiments were
+        only created or dropped that way. Returns the number of experiments
+        indexed.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        for key in self.catalog_indexes:
+            self.catalog.create_index(f"meta.{key}")
+
+        names = self.keys()
+        metas = self.read_many(names, "meta")
+        self._catalog_metas(metas)
+        self._drop_from_catalog(names)
+
+        self._catalog_ready = True
+        return len(metas)
+
+    def reconcile(self) -> int:
+        """
+        Index experiments created, and unindex those dropped, without the catalog.
+
+        Only the metas of new experiments are read, so this is cheaper than
+        `build_catalog`, but metas rewritten behind the catalog's back are not
+        picked up. Returns the number of catalog entries added or removed.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        if not self._has_catalog():
+            self.build_catalog()
+            return self.catalog.count_documents({})
+
+        names = self.keys()
+        indexed = {doc["_id"] for doc in self.catalog.find({}, {"_id": 1})}
+        missing = self.read_many([n for n in names if n not in indexed], "meta")
+
+        self._catalog_metas(missing)
+        return len(missing) + self._drop_from_catalog(names)
+
+    def _drop_from_catalog(self, names: List[str]) -> int:
+        # entries of experiments that no longer exist.
+        dropped = self.catalog.delete_many({"_id": {"$nin": list(names)}})
+        return dropped.deleted_count
+
+    def _index_meta(self, exp_id: str, update: dict):
+        if not self._has_catalog():
+            self.build_catalog()
+        else:
+            self.catalog.update_one({"_id": exp_id}, update, upsert=True)
+
+    def find(self, criteria: dict = None) -> dict:
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        if not self._has_catalog():
+            return super().find(criteria)
+
+        # the server filter is a superset; `meta_matches` keeps exact equality.
+        return {
+            doc["_id"]: doc["meta"]
+            for doc in self.catalog.find(catalog_query(criteria))
+            if "meta" in doc and meta_matches(doc["_id"], doc["meta"], criteria)
+        }
+
+    def reduce(
+        self,
+        exp_id: str,
+        field: str,
+        entry_key: str,
+        reduce: str,
+        experiment_reduce: str = None,
+        n: int = None,
+    ):
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        # array operators need native arrays (see `upgrade_layout`).
+        if self._layout(exp_id) != NATIVE:
+            raise NotImplementedError
+
+        pipeline = [
+            {"$project": {"_id": 0, "e": f"${field}"}},
+            {"$unwind": {"path": "$e", "includeArrayIndex": "i"}},
+        ] + reduce_stages("$e", "$i", entry_key, reduce, experiment_reduce, n)
+
+        return reduced(self.db[exp_id].aggregate(pipeline), experiment_reduce)
+
+    def _union_find(self, exp_ids: List[str], projection: dict, chunk_size: int = 256):
+        # one aggregation per chunk of collections, instead of one find per collection.
+        for chunk in chunked_iterable(exp_ids, chunk_size):
+            first, rest = chunk[0], chunk[1:]
+            pipeline = [{"$project": projection}] if projection else []
+
+            for exp_id in rest:
+                pipeline.append(
+                    {
+                        "$unionWith": {
+                            "coll": exp_id,
+                            "pipeline": [{"$project": projection}] if projection else [],
+                        }
+                    }
+                )
+
+            if len(pipeline) == 0:
+                yield from self.db[first].find({})
+            else:
+                yield from self.db[first].aggregate(pipeline)
+
+    def read_many(
+        self,
+        exp_ids: List[str],
+        field: str,
+        workers: int = 8,
+    ):
+        if self.is_read_mode():
+            return {
+                doc["_id"]: self._decode(doc, field)
+                for doc in self._union_find(exp_ids, {field: 1, LAYOUT_KEY: 1})
+                if field in doc
+            }
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def get_many(
+        self,
+        exp_ids: List[str],
+        workers: int = 8,
+    ):
+        if self.is_read_mode():
+            return {
+                doc["_id"]: self._decode(doc) for doc in self._union_find(exp_ids, None)
+            }
         else:
             raise ValueError("Read mode is not enabled.")
 
+    def _subfield_path(self, exp_id: str, field: str, key: str) -> str:
+        # ">>i" keys address list elements; native arrays take the plain index.
+        if self._layout(exp_id) == NATIVE and key.startswith(LIST_SYM):
+            return f"{field}.{int(key[len(LIST_SYM):])}"
+        else:
+            return f"{field}.{key}"
+
+    def _encode(self, exp_id: str, data: Any):
+        return data if self._layout(exp_id) == NATIVE else encode_mongo_format(data)
+
     def read_subfield(
         self,
         exp_id: str,
@@ -153,14 +682,16 @@ class MongoStorage(Storage):
         collection = self.db[exp_id]
 
         if self.is_read_mode():
-            return decode_mongo_format(
-                collection.find_one(
-                    {},
-                    {f"{field}.{key}": 1},
-                )[
-                    field
-                ][key]
-            )
+            if self._layout(exp_id) == NATIVE and key.startswith(LIST_SYM):
+                index = int(key[len(LIST_SYM) :])
+                document = collection.find_one({}, {field: {"$slice": [index, 1]}})
+                if len(document[field]) == 0:
+                    raise KeyError(key)
+
+                return document[field][0]
+
+            value = collection.find_one({}, {f"{field}.{key}": 1})[field][key]
+            return value if self._layout(exp_id) == NATIVE else decode_mongo_format(value)
         else:
             raise ValueError("Read mode is not enabled.")
 
@@ -169,7 +700,7 @@ class MongoStorage(Storage):
         if self.is_read_mode():
             return list(
                 filter(
-                    lambda x: x != "_id",
+                    lambda x: x not in ("_id", LAYOUT_KEY),
                     collection.find_one().keys(),
                 )
             )
@@ -179,65 +710,131 @@ class MongoStorage(Storage):
     def read_field_keys(self, exp_id: str, field: str):
         collection = self.db[exp_id]
         if self.is_read_mode():
+            value = collection.find_one({}, {field: 1})[field]
+
+            if isinstance(value, list):
+                return [f"{LIST_SYM}{i}" for i in range(len(value))]
+
             return list(
                 filter(
                     lambda x: x != "_id",
-                    collection.find_one()[field].keys(),
+                    value.keys(),
                 )
             )
         else:
             raise ValueError("Read mode is not enabled.")
 
+    def is_list(self, exp_id: str, field: str) -> bool:
+        if self._layout(exp_id) != NATIVE:
+            return super().is_list(exp_id, field)
+
+        if self.is_read_mode():
+            document = next(
+                self.db[exp_id].aggregate(
+                    [
+                        {"$match": {field: {"$exists": True}}},
+                        {"$project": {"l": {"$isArray": f"${field}"}}},
+                    ]
+                ),
+                None,
+            )
+            if document is None:
+                raise KeyError(field)
+
+            return document["l"]
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _collection(self, exp_id: str):
+        return self.db.get_collection(exp_id, write_concern=self.write_concern)
+
+    def _set_elements(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+        start: int = 0,
+        batch_size: int = 1000,
+        unset: bool = False,
+    ):
+        # list elements as nested documents, up to `batch_size` elements (and
+        # MAX_UPDATE_BYTES) per update, all sent in one ordered bulk_write.
+        requests = []
+        if unset:
+            requests.append(UpdateOne({"_id": exp_id}, {"$unset": {field: ""}}))
+
+        first = start
+        for batch in sized_batches(map(encode_mongo_format, data), batch_size):
+            requests.append(
+                UpdateOne(
+                    {"_id": exp_id},
+                    {
+                        "$set": {
+                            f"{field}.{LIST_SYM}{i}": d
+                            for i, d in enumerate(batch, start=first)
+                        }
+                    },
+                )
+            )
+            first += len(batch)
+
+        if len(requests) > 0:
+            self._collection(exp_id).bulk_write(requests, ordered=True)
+
+    def _push_elements(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+        batch_size: int = 1000,
+        replace: bool = False,
+    ):
+        # native arrays: appends are $push/$each of the new elements only.
+        requests = []
+        if replace:
+            requests.append(UpdateOne({"_id": exp_id}, {"$set": {field: []}}))
+
+        for batch in sized_batches(data, batch_size):
+            requests.append(
+                UpdateOne({"_id": exp_id}, {"$push": {field: {"$each": batch}}})
+            )
+
+        if len(requests) > 0:
+            self._collection(exp_id).bulk_write(requests, ordered=True)
+
     def write(
         self,
         exp_id: str,
         field: str,
         data: Any,
-        batch_size: int = 1,
+        batch_size: int = 1000,
     ):
-        collection = self.db[exp_id]
-
         if self.is_write_mode():
 
             if isinstance(data, List):
 
-                async def write_async():
+                if not self.exists(exp_id):
+                    raise ValueError(f"Collection {exp_id} does not exist.")
+
+                # replace the whole list, not only the indexes being written.
+                if self._layout(exp_id) == NATIVE:
+                    self._push_elements(
+                        exp_id, field, data, batch_size=batch_size, replace=True
+                    )
+                else:
+                    self._set_elements(
+                        exp_id, field, data, batch_size=batch_size, unset=True
+                    )
 
-                    for batch in tqdm(
-                        list(
-                            chunked_iterable(
-                                data,
-                                batch_size,
-                            )
-                        )
-                    ):
-
-                        tasks = [
-                            self.write_subfield_async(
-                                exp_id,
-                                field,
-                                f"{LIST_SYM}{i}",
-                                d,
-                            )
-                            for i, d in enumerate(batch)
-                        ]
-                        await asyncio.gather(*tasks)
-
-                asyncio.run(write_async())
-
-                """for i, d in enumerate(data):
-                    self.write_subfield(
-                        exp_id,
-                        field,
-                        f"{LIST_SYM}{i}",
-                        d,
-                )"""
             else:
-                collection.update_one(
+                self._collection(exp_id).update_one(
                     {},
                     {"$set": {field: data}},
                     upsert=True,
                 )
+
+                if field == "meta":
+                    self._index_meta(exp_id, {"$set": {"meta": data}})
         else:
             raise ValueError("Write mode is not enabled.")
 
@@ -248,7 +845,26 @@ class MongoStorage(Storage):
         key: str,
         data: Any,
     ):
-        asyncio.run(self.write_subfield_async(exp_id, field, key, data))
+        if self.is_write_mode():
+            if not self.exists(exp_id):
+
+                raise ValueError(f"Collection {exp_id} does not exist.")
+
+            self._collection(exp_id).update_one(
+                {"_id": exp_id},
+                {
+                    "$set": {
+                        self._subfield_path(exp_id, field, key): self._encode(
+                            exp_id, data
+                        )
+                    }
+                },
+            )
+
+            if field == "meta":
+                self._index_meta(exp_id, {"$set": {f"meta.{key}": data}})
+        else:
+            raise ValueError("Write mode is not enabled.")
 
     async def write_subfield_async(
         self,
@@ -263,46 +879,48 @@ class MongoStorage(Storage):
 
                 raise ValueError(f"Collection {exp_id} does not exist.")
 
-            if isinstance(data, dict):
+            collection = self.async_db.get_collection(
+                exp_id,
+                write_concern=self.write_concern,
+            )
 
-                tasks = [
-                    self.write_subfield_async(
-                        exp_id,
-                        f"{field}.{key}",
-                        k,
-                        v,
-                    )
-                    for k, v in data.items()
-                ]
-                await asyncio.gather(*tasks)
+            await collection.update_one(
+                {"_id": exp_id},
+                {
+                    "$set": {
+                        self._subfield_path(exp_id, field, key): self._encode(
+                            exp_id, data
+                        )
+                    }
+                },
+            )
 
-            elif isinstance(data, List):
+            if field == "meta":
+                self._index_meta(exp_id, {"$set": {f"meta.{key}": data}})
+        else:
+            raise ValueError("Write mode is not enabled.")
 
-                tasks = [
-                    self.write_subfield_async(
-                        exp_id,
-                        f"{field}.{key}",
-                        f"{LIST_SYM}{i}",
-                        d,
-                    )
-                    for i, d in enumerate(data)
-                ]
-                await asyncio.gather(*tasks)
+    def _next_list_index(self, exp_id: str, field: str) -> int:
 
-            else:
+        try:
+            list_indexes = self.read_field_keys(exp_id, field)
+        except KeyError:
+            list_indexes = []
 
-                collection = self.async_db.get_collection(
-                    exp_id,
-                    write_concern=WriteConcern(w=0),
-                )
+        if len(list_indexes) == 0:
+            return 0
 
-                await collection.update_one(
-                    {"_id": exp_id},
-                    {"$set": {f"{field}.{key}": data}},
-                    # upsert=True,
-                )
-        else:
-            raise ValueError("Write mode is not enabled.")
+        if not (LIST_SYM in list_indexes[0]):
+            raise ValueError(f"Field:{field} is not a list.")
+
+        max_ind = max(
+            map(
+                lambda x: int(x.replace(LIST_SYM, "")),
+                list_indexes,
+            )
+        )
+
+        return max_ind + 1
 
     def append_subfield(
         self,
@@ -310,6 +928,14 @@ class MongoStorage(Storage):
         field: str,
         data: Any,
     ):
+        self.extend_subfield(exp_id, field, [data])
+
+    def extend_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+    ):
 
         if self.is_write_mode():
 
@@ -317,34 +943,441 @@ class MongoStorage(Storage):
 
                 raise ValueError(f"Collection {exp_id} does not exist.")
 
-            try:
-                list_indexes = self.read_field_keys(exp_id, field)
-            except KeyError:
-                list_indexes = []
+            if self._layout(exp_id) == NATIVE:
+                self._push_elements(exp_id, field, data)
+            else:
+                start = self._next_list_index(exp_id, field)
+                self._set_elements(exp_id, field, data, start=start)
+
+        else:
+            raise ValueError("Write mode is not enabled.")
+
+    def upgrade_layout(self, exp_ids: List[str] = None) -> int:
+        """
+        Rewrite legacy ">>i" documents (all, or `exp_ids`) with native arrays.
+
+        Each document is replaced in a single write, so an interrupted upgrade
+        can simply be run again. Returns the number of documents rewritten.
+        """
+
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        upgraded = 0
+        for exp_id in tqdm(self.keys() if exp_ids is None else exp_ids):
+            if self._layout(exp_id) == NATIVE:
+                continue
+
+            document = decode_mongo_format(self.db[exp_id].find_one())
+            document[LAYOUT_KEY] = NATIVE
+
+            self._collection(exp_id).replace_one({"_id": document["_id"]}, document)
+
+            with self._collections_lock:
+                self._layouts[exp_id] = NATIVE
+            upgraded += 1
+
+        return upgraded
+
+
+class MongoInstanceStorage(Storage):
+    """
+    Experiments in two collections shared by every experiment.
+
+    `<collection>` has one document per experiment with its non-list fields
+    (e.g. meta) and, under `_lists`, the element key and next index of each
+    list field. `<collection>_elements` has one document per list element,
+    `{exp_id, field: <key>, idx, v}`, under a unique index on
+    `(exp_id, field, idx)`; instances and evals are keyed the same way.
+    Experiments are not bound by the 16 MB document limit, `iterable` streams
+    elements through a batched cursor and `count` is a `count_documents` on
+    the index.
+
+    Appends reserve their indices with an atomic `$inc` of the next index, so
+    concurrent writers do not collide. `write` inserts the new elements under
+    a fresh key and swaps it in with one update of the experiment document,
+    so readers see the old list or the new one, never a partial one.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        mode: str = "r",  # can be w, r, and rw
+        database_name: str = "test3",
+        collection: str = "experiments",
+        write_concern: dict = None,
+        batch_size: int = 1000,
+        catalog_indexes: List[str] = CATALOG_INDEXES,
+    ):
+        super().__init__(mode)
+        self.uri = uri
+        self.client = pymongo.MongoClient(uri)
+        self.db = self.client.get_database(database_name)
+        self.batch_size = batch_size
+
+        write_concern = WriteConcern(**(write_concern or {"w": 1}))
+        self.experiments = self.db.get_collection(
+            collection, write_concern=write_concern
+        )
+        self.elements = self.db.get_collection(
+            f"{collection}_elements", write_concern=write_concern
+        )
+
+        if self.is_write_mode():
+            self.elements.create_index(
+                [("exp_id", 1), ("field", 1), ("idx", 1)], unique=True
+            )
+            # the experiment documents double as the catalog of `find`.
+            for key in catalog_indexes:
+                self.experiments.create_index(f"meta.{key}")
+
+    def _experiment(self, exp_id: str, projection: dict = None) -> dict:
+        document = self.experiments.find_one({"_id": exp_id}, projection)
+        if document is None:
+            raise KeyError(exp_id)
+
+        return document
 
-            if len(list_indexes) == 0:
-                i = 0
+    def create(
+        self,
+        exp_id: str,
+        force: bool = False,
+        exists_ok=False,
+    ):
+        if self.is_write_mode():
 
+            if self.exists(exp_id):
+                if exists_ok:
+                    return self.document(exp_id)
+                elif force:
+                    self.delete(exp_id)
+                else:
+                    raise ValueError(f"Document {exp_id} already exists.")
+
+            self.experiments.insert_one({"_id": exp_id, "_lists": {}})
+
+            return self.document(exp_id)
+        else:
+            raise ValueError("Write mode is not enabled.")
+
+    def delete(self, exp_id: str):
+        if self.is_write_mode():
+            self.elements.delete_many({"exp_id": exp_id})
+            self.experiments.delete_one({"_id": exp_id})
+        else:
+            raise ValueError("Write mode is not enabled.")
+
+    def keys(self):
+        if self.is_read_mode():
+            return [d["_id"] for d in self.experiments.find({}, {"_id": 1})]
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def exists(self, exp_id: str):
+        if self.is_read_mode():
+            return self.experiments.count_documents({"_id": exp_id}, limit=1) > 0
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def fields(self, exp_id: str):
+        if self.is_read_mode():
+            document = self._experiment(exp_id)
+            values = [k for k in document if k not in ("_id", "_lists")]
+            return values + list(document["_lists"])
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def get(self, exp_id: str):
+        if self.is_read_mode():
+            document = self._experiment(exp_id)
+            for field in document.pop("_lists"):
+                document[field] = self.read(exp_id, field)
+
+            return document
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def find(self, criteria: dict = None) -> dict:
+        if self.is_read_mode():
+            # the server filter is a superset; `meta_matches` keeps exact equality.
+            return {
+                doc["_id"]: doc["meta"]
+                for doc in self.experiments.find(catalog_query(criteria), {"meta": 1})
+                if "meta" in doc and meta_matches(doc["_id"], doc["meta"], criteria)
+            }
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def is_list(self, exp_id: str, field: str) -> bool:
+        if self.is_read_mode():
+            document = self._experiment(exp_id, {field: 1, "_lists": 1})
+            if field in document["_lists"]:
+                return True
+            elif field in document:
+                return False
             else:
+                raise KeyError(field)
+        else:
+            raise ValueError("Read mode is not enabled.")
 
-                if not (LIST_SYM in list_indexes[0]):
-                    raise ValueError(f"Field:{field} is not a list.")
+    def _list_key(self, exp_id: str, field: str) -> str:
+        # the elements of a list live under its key; the field name until the
+        # first `write` of the list.
+        document = self._experiment(exp_id, {f"_lists.{field}": 1})
+        return document.get("_lists", {}).get(field, {}).get("key", field)
 
-                max_ind = max(
-                    map(
-                        lambda x: int(x.replace(LIST_SYM, "")),
-                        list_indexes,
-                    )
+    def read(self, exp_id: str, field: str):
+        if self.is_read_mode():
+            if self.is_list(exp_id, field):
+                return list(self.iterable(exp_id, field))
+            else:
+                return self._experiment(exp_id, {field: 1})[field]
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def _cursor(self, exp_id: str, field: str, fields: List[str], where):
+        query = {"exp_id": exp_id, "field": self._list_key(exp_id, field)}
+        query.update({f"v.{k}": v for k, v in pushdown_match(where).items()})
+
+        tree = server_projection(fields, where)
+        projection = {"_id": 0, "idx": 1}
+        if tree:
+            projection.update({f"v.{key}": 1 for key in tree})
+        else:
+            projection["v"] = 1
+
+        return self.elements.find(query, projection, batch_size=self.batch_size).sort(
+            "idx", 1
+        )
+
+    def iterable(
+        self,
+        exp_id: str,
+        field: str,
+        fields: List[str] = None,
+        where=None,
+    ):
+        if self.is_read_mode():
+            # elements whose projection is empty have no "v" at all.
+            elements = (
+                e.get("v", {}) for e in self._cursor(exp_id, field, fields, where)
+            )
+            if fields is None and where is None:
+                return elements
+
+            # the server side filter is a superset; refine it client side.
+            return select(elements, fields=fields, where=where)
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def count(self, exp_id: str, field: str) -> int:
+        if self.is_read_mode():
+            n = self.elements.count_documents(
+                {"exp_id": exp_id, "field": self._list_key(exp_id, field)}
+            )
+            if n == 0 and not self.is_list(exp_id, field):
+                raise ValueError(f"Field:{field} is not a list.")
+
+            return n
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def sample(
+        self,
+        exp_id: str,
+        field: str,
+        k: int,
+        seed: int = None,
+        where=None,
+        fields: List[str] = None,
+    ):
+        match = pushdown_match(where)
+
+        # $sample is not seedable and cannot apply python predicates.
+        if seed is not None or callable(where) or len(match) < len(where or {}):
+            return super().sample(exp_id, field, k, seed, where, fields)
+
+        if self.is_read_mode():
+            query = {"exp_id": exp_id, "field": self._list_key(exp_id, field)}
+            query.update({f"v.{key}": v for key, v in match.items()})
+
+            elements = self.elements.aggregate(
+                [
+                    {"$match": query},
+                    {"$sample": {"size": k}},
+                    {"$sort": {"idx": 1}},
+                    {"$project": {"_id": 0, "v": 1}},
+                ]
+            )
+            return list(
+                select((e["v"] for e in elements), fields=fields, where=where)
+            )
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def reduce(
+        self,
+        exp_id: str,
+        field: str,
+        entry_key: str,
+        reduce: str,
+        experiment_reduce: str = None,
+        n: int = None,
+    ):
+        if self.is_read_mode():
+            match = {"exp_id": exp_id, "field": self._list_key(exp_id, field)}
+            pipeline = [{"$match": match}] + reduce_stages(
+                "$v", "$idx", entry_key, reduce, experiment_reduce, n
+            )
+
+            return reduced(self.elements.aggregate(pipeline), experiment_reduce)
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def read_field_keys(self, exp_id: str, field: str):
+        if self.is_read_mode():
+            if self.is_list(exp_id, field):
+                return [f"{LIST_SYM}{i}" for i in range(self.count(exp_id, field))]
+            else:
+                return list(self.read(exp_id, field).keys())
+        else:
+            raise ValueError("Read mode is not enabled.")
+
+    def read_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        key: str,
+    ):
+        if self.is_read_mode():
+            if key.startswith(LIST_SYM):
+                element = self.elements.find_one(
+                    {
+                        "exp_id": exp_id,
+                        "field": self._list_key(exp_id, field),
+                        "idx": int(key[len(LIST_SYM) :]),
+                    }
                 )
+                if element is None:
+                    raise KeyError(key)
 
-                i = max_ind + 1
+                return element["v"]
+            else:
+                return self.read(exp_id, field)[key]
+        else:
+            raise ValueError("Read mode is not enabled.")
 
-            self.write_subfield(
-                exp_id,
-                field,
-                f"{LIST_SYM}{i}",
-                data,
+    def _insert_elements(self, exp_id: str, key: str, data: List[Any], start: int):
+        for offset, batch in enumerate(chunked_iterable(data, self.batch_size)):
+            first = start + offset * self.batch_size
+            self.elements.insert_many(
+                [
+                    {"exp_id": exp_id, "field": key, "idx": i, "v": d}
+                    for i, d in enumerate(batch, start=first)
+                ],
+                ordered=True,
+            )
+
+    def write(
+        self,
+        exp_id: str,
+        field: str,
+        data: Any,
+    ):
+        if self.is_write_mode():
+            if not self.exists(exp_id):
+                raise ValueError(f"Collection {exp_id} does not exist.")
+
+            if isinstance(data, List):
+                # fill a fresh key, then swap it in with one update.
+                key = f"{field}:{uuid.uuid4().hex}"
+                self._insert_elements(exp_id, key, data, start=0)
+                update = {
+                    "$set": {f"_lists.{field}": {"key": key, "next": len(data)}},
+                    "$unset": {field: ""},
+                }
+            else:
+                update = {"$set": {field: data}, "$unset": {f"_lists.{field}": ""}}
+
+            previous = self.experiments.find_one_and_update(
+                {"_id": exp_id}, update, projection={f"_lists.{field}": 1}
             )
+            if previous is None:  # deleted meanwhile
+                raise ValueError(f"Collection {exp_id} does not exist.")
 
+            entry = previous.get("_lists", {}).get(field)
+            if entry is not None:
+                self.elements.delete_many(
+                    {"exp_id": exp_id, "field": entry.get("key", field)}
+                )
+        else:
+            raise ValueError("Write mode is not enabled.")
+
+    def write_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        key: str,
+        data: Any,
+    ):
+        if self.is_write_mode():
+            if not self.exists(exp_id):
+                raise ValueError(f"Collection {exp_id} does not exist.")
+
+            if key.startswith(LIST_SYM):
+                index = int(key[len(LIST_SYM) :])
+                document = self.experiments.find_one_and_update(
+                    {"_id": exp_id},
+                    {"$max": {f"_lists.{field}.next": index + 1}},
+                    projection={f"_lists.{field}": 1},
+                    return_document=ReturnDocument.AFTER,
+                )
+                self.elements.update_one(
+                    {
+                        "exp_id": exp_id,
+                        "field": document["_lists"][field].get("key", field),
+                        "idx": index,
+                    },
+                    {"$set": {"v": data}},
+                    upsert=True,
+                )
+            else:
+                self.experiments.update_one(
+                    {"_id": exp_id}, {"$set": {f"{field}.{key}": data}}
+                )
+        else:
+            raise ValueError("Write mode is not enabled.")
+
+    def append_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        data: Any,
+    ):
+        self.extend_subfield(exp_id, field, [data])
+
+    def extend_subfield(
+        self,
+        exp_id: str,
+        field: str,
+        data: List[Any],
+    ):
+        if self.is_write_mode():
+            # reserve the indices; concurrent appends get disjoint ranges.
+            document = self.experiments.find_one_and_update(
+                {"_id": exp_id, field: {"$exists": False}},
+                {"$inc": {f"_lists.{field}.next": len(data)}},
+                projection={f"_lists.{field}": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is None:
+                if not self.exists(exp_id):
+                    raise ValueError(f"Collection {exp_id} does not exist.")
+                raise ValueError(f"Field:{field} is not a list.")
+
+            entry = document["_lists"][field]
+            self._insert_elements(
+                exp_id, entry.get("key", field), data, start=entry["next"] - len(data)
+            )
         else:
             raise ValueError("Write mode is not enabled.")
@@ -18,25 +18,394 @@ from types import MappingProxyType
 import itertools
 import ijson
 
-from expkit.storage.base import Storage
+from expkit.storage.base import Storage, select
+from expkit.storage.jsonstream import count_json_array, iter_json_array
 
 
 import os
+import re
+import threading
+import warnings
+from fnmatch import fnmatch
+from collections import OrderedDict
+from contextlib import contextmanager
+import weakref
 import zipfile
 import orjson
-from typing import List, Any
+from typing import Dict, List, Any
+
+CHUNK_MEMBER = re.compile(r"^(.*)\.chunk-(\d+)\.json$")
+
+
+def _member_field(filename: str):
+    """(field, chunk number) of a member name; chunk is None for field members."""
+    match = CHUNK_MEMBER.match(filename)
+    if match is not None:
+        return match.group(1), int(match.group(2))
+
+    return filename[: -len(".json")], None
+
+
+def live_members(zf: zipfile.ZipFile) -> Dict[str, List[zipfile.ZipInfo]]:
+    """
+    Members holding the current value of each field, in read order.
+
+    Members are appended, never replaced, so a field is its last `<field>.json`
+    member followed by the `<field>.chunk-<n>.json` members appended after it.
+    """
+    members = {}
+    for info in zf.infolist():
+        field, chunk = _member_field(info.filename)
+
+        if chunk is None:
+            members[field] = [info]
+        else:
+            members.setdefault(field, []).append(info)
+
+    return members
+
+
+class ZipHandle:
+    __slots__ = ("zf", "stamp", "users", "stale", "_members")
+
+    def __init__(self, zf: zipfile.ZipFile, stamp: tuple):
+        self.zf = zf
+        self.stamp = stamp
+        self.users = 0
+        self.stale = False
+        self._members = None
+
+    def members(self) -> Dict[str, List[zipfile.ZipInfo]]:
+        # the central directory of a read handle never changes.
+        if self._members is None:
+            self._members = live_members(self.zf)
+        return self._members
+
+
+class ZipHandlePool:
+    """
+    LRU pool of open read handles, so the central directory of an archive is
+    parsed once rather than on every read.
+
+    A handle is reopened when the archive's mtime, size or inode changed, and
+    can be dropped explicitly after local writes with `invalidate`. Dropped or
+    evicted handles are closed once no reader uses them.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # open archives and the lock are per process; a copy starts empty.
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+    @contextmanager
+    def open(self, path: str):
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is not None and handle.stamp != stamp:
+                self._drop(path)
+                handle = None
+
+            if handle is not None:
+                self._handles.move_to_end(path)
+                handle.users += 1
+
+        if handle is None:
+            # parse the directory outside the lock; keep whichever handle
+            # reached the pool first.
+            opened = ZipHandle(zipfile.ZipFile(path, "r"), stamp)
+
+            with self._lock:
+                handle = self._handles.get(path)
+                if handle is not None and handle.stamp == stamp:
+                    opened.zf.close()
+                    self._handles.move_to_end(path)
+                else:
+                    self._drop(path)
+                    handle = opened
+                    self._handles[path] = handle
+                    while len(self._handles) > max(1, self.maxsize):
+                        self._drop(next(iter(self._handles)))
+
+                handle.users += 1
+
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.users -= 1
+                if handle.stale and handle.users == 0:
+                    handle.zf.close()
+
+    def _drop(self, path: str):
+        handle = self._handles.pop(path, None)
+        if handle is not None:
+            handle.stale = True
+            if handle.users == 0:
+                handle.zf.close()
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._drop(path)
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._handles):
+                self._drop(path)
+
+
+ZIP_CODECS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bz2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+
+class CompressionPolicy:
+    """
+    Chooses the codec and level of each member from its field name and size.
+
+    Members smaller than `min_size` bytes are stored uncompressed. Otherwise the
+    first `fields` pattern (fnmatch style, e.g. "eval_*") matching the field
+    gives the `(codec, level)`, and `default` is used when none does. Codecs
+    are "stored", "deflate", "bz2" and "lzma"; a level of None is the codec's
+    default (lzma has no levels).
+    """
+
+    def __init__(
+        self,
+        default: tuple = ("deflate", 6),
+        fields: Dict[str, tuple] = None,
+        min_size: int = 0,
+    ):
+        self.default = default
+        self.fields = {} if fields is None else fields
+        self.min_size = min_size
+
+        for codec, _ in [default, *self.fields.values()]:
+            if codec not in ZIP_CODECS:
+                raise ValueError(f"Unknown zip codec {codec}.")
+
+    def choose(self, field: str, size: int) -> tuple:
+        """(compress_type, compresslevel) for a member of `field`."""
+        if size < self.min_size:
+            return zipfile.ZIP_STORED, None
+
+        codec, level = self.default
+        for pattern, rule in self.fields.items():
+            if fnmatch(field, pattern):
+                codec, level = rule
+                break
+
+        return ZIP_CODECS[codec], level
+
+
+def make_compression_policy(compression) -> CompressionPolicy:
+    if compression is None:
+        return CompressionPolicy()
+    elif isinstance(compression, CompressionPolicy):
+        return compression
+    elif isinstance(compression, dict):
+        return CompressionPolicy(**compression)
+    else:
+        raise ValueError(f"Unknown compression policy {compression}.")
+
+
+def write_member(
+    zf: zipfile.ZipFile, name: str, payload: bytes, policy: CompressionPolicy
+):
+    compress_type, level = policy.choose(_member_field(name)[0], len(payload))
+
+    with warnings.catch_warnings():
+        # rewritten fields are appended as new members with the same name;
+        # see `ZipStorage.vacuum`.
+        warnings.filterwarnings("ignore", "Duplicate name", UserWarning)
+        zf.writestr(name, payload, compress_type=compress_type, compresslevel=level)
+
+
+class ZipAppender:
+    """An archive open for appending, with the last chunk number of each field."""
+
+    __slots__ = ("zf", "chunks")
+
+    def __init__(self, path: str):
+        self.zf = zipfile.ZipFile(path, "a")
+        self.chunks = {}
+        for info in self.zf.infolist():
+            field, chunk = _member_field(info.filename)
+            if chunk is not None:
+                self.chunks[field] = max(self.chunks.get(field, -1), chunk)
+
+    def write_chunk(self, field: str, elements: List[Any], policy: CompressionPolicy):
+        number = self.chunks.get(field, -1) + 1
+        write_member(
+            self.zf, f"{field}.chunk-{number}.json", orjson.dumps(elements), policy
+        )
+        self.chunks[field] = number
+
+
+class ZipAppendPool:
+    """
+    Archives held open for appending, so an append only writes its member.
+
+    Opening an archive in append mode parses its central directory and closing
+    it writes the directory back, both linear in the number of members, so a
+    handle is kept until `close` rather than reopened per append. Until then
+    the archive on disk has no central directory: it cannot be read, and a
+    crash leaves it unreadable. At most `maxsize` archives are held; the least
+    recently used one is closed first. Callers serialise access.
+    """
+
+    def __init__(self, base_dir: str, maxsize: int = 256):
+        self.base_dir = base_dir
+        self.maxsize = maxsize
+        self._appenders = OrderedDict()
+
+    def get(self, exp_id: str) -> ZipAppender:
+        appender = self._appenders.get(exp_id)
+        if appender is not None:
+            self._appenders.move_to_end(exp_id)
+            return appender
+
+        while len(self._appenders) >= max(1, self.maxsize):
+            self._appenders.popitem(last=False)[1].zf.close()
+
+        appender = ZipAppender(f"{self.base_dir}/{exp_id}.zip")
+        self._appenders[exp_id] = appender
+        return appender
+
+    def close(self, exp_id: str = None) -> List[str]:
+        """Close the archives (`exp_id` only, if given); returns their ids."""
+        closed = [key for key in self._appenders if exp_id is None or key == exp_id]
+        for key in closed:
+            self._appenders.pop(key).zf.close()
+        return closed
+
+
+def write_chunks(
+    pending: Dict[tuple, List[Any]],
+    appenders: ZipAppendPool,
+    lock,
+    policy: CompressionPolicy,
+) -> List[str]:
+    """
+    Write buffered appends as chunk members of the archives held by `appenders`.
+
+    Returns:
+        The ids of the experiments written.
+    """
+    with lock:
+        written = []
+        for (exp_id, field), elements in pending.items():
+            if len(elements) > 0:
+                appenders.get(exp_id).write_chunk(field, elements, policy)
+                written.append(exp_id)
+        pending.clear()
+
+        return list(dict.fromkeys(written))
+
+
+def finish_appends(
+    pending: Dict[tuple, List[Any]],
+    appenders: ZipAppendPool,
+    lock,
+    policy: CompressionPolicy,
+):
+    """Write buffered appends and close every archive held for appending."""
+    with lock:
+        write_chunks(pending, appenders, lock, policy)
+        appenders.close()
 
 
 class ZipStorage(Storage):
-    def __init__(self, base_dir: str, mode: str = "r"):
+    """
+    Stores each experiment as a zip archive with one member per field.
+
+    Appends are written as numbered chunk members (`<field>.chunk-<n>.json`),
+    and reads merge the field member with its chunks. Archives written to are
+    held open (see `ZipAppendPool`) so the cost of an append does not grow with
+    the number of members; their central directory is written on `flush`/
+    `close`, before the experiment is read by this storage, and when the
+    storage is garbage collected or the interpreter exits. Until then other
+    readers cannot open the archive and a crash leaves it unreadable, and
+    alternating appends and reads of one experiment rewrite its directory each
+    time. With `append_buffer` > 1 appends are also buffered in memory until
+    that many elements are pending, which makes fewer, larger members.
+    Rewriting a field adds a new member and leaves the old ones in the archive;
+    `vacuum` rewrites archives with only the live members.
+
+    Up to `max_open` archives are kept open for reading (see `ZipHandlePool`).
+    `iterable` and `count` decompress members as a stream, decoding them with
+    `stream_decoder` (see `jsonstream.iter_json_array`), so memory stays bounded.
+
+    `compression` picks the codec of each member (a `CompressionPolicy` or a
+    dict of its arguments); the default deflates everything at level 6.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        mode: str = "r",
+        append_buffer: int = 1,
+        max_open: int = 256,
+        stream_decoder: str = "auto",
+        compression=None,
+    ):
         super().__init__(mode)
         self.base_dir = base_dir
+        self.append_buffer = append_buffer
+        self.stream_decoder = stream_decoder
+        self.compression = make_compression_policy(compression)
 
         if not self.valid_storage():
             raise ValueError(
                 "Invalid storage. This path already has non-zip files. It has a storage of other type."
             )
 
+        self.max_open = max_open
+        self._handles = ZipHandlePool(max_open)
+        self._init_pending()
+
+    def _init_pending(self):
+        self._pending = {}  # (exp_id, field) -> buffered elements
+        self._pending_count = 0
+        self._pending_lock = threading.RLock()
+        self._appenders = ZipAppendPool(self.base_dir, self.max_open)
+
+        weakref.finalize(
+            self,
+            finish_appends,
+            self._pending,
+            self._appenders,
+            self._pending_lock,
+            self.compression,
+        )
+
+    def __getstate__(self):
+        # copies (e.g. `ExpSetup.query`) share the archives, not the buffered
+        # appends, the append handles or the lock; write the appends first.
+        if self.is_write_mode():
+            self.flush()
+
+        state = self.__dict__.copy()
+        for name in ("_pending", "_pending_count", "_pending_lock", "_appenders"):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_pending()
+
     def valid_storage(self) -> List[str]:
         if not self.is_read_mode():
             raise ValueError("Read mode is not enabled.")
@@ -48,6 +417,66 @@ class ZipStorage(Storage):
     def _get_zip_path(self, exp_id: str) -> str:
         return f"{self.base_dir}/{exp_id}.zip"
 
+    def _write_pending(self, exp_id: str = None):
+        # buffered appends (of `exp_id` only, if given) to the held archives.
+        with self._pending_lock:
+            if exp_id is None:
+                write_chunks(
+                    self._pending, self._appenders, self._pending_lock, self.compression
+                )
+                self._pending_count = 0
+            else:
+                pending = {
+                    key: self._pending.pop(key)
+                    for key in list(self._pending)
+                    if key[0] == exp_id
+                }
+                self._pending_count -= sum(len(e) for e in pending.values())
+                write_chunks(
+                    pending, self._appenders, self._pending_lock, self.compression
+                )
+
+    def flush(self, exp_id: str = None):
+        """Write buffered appends and the central directory of archives written
+        to (of `exp_id` only, if given), so they can be read."""
+        with self._pending_lock:
+            self._write_pending(exp_id)
+            written = self._appenders.close(exp_id)
+
+        for written_id in written:
+            self._handles.invalidate(self._get_zip_path(written_id))
+
+    def close(self):
+        self.flush()
+        self._handles.clear()
+
+    @contextmanager
+    def _open(self, exp_id: str):
+        # pooled read handle, after writing the experiment's buffered appends.
+        self.flush(exp_id)
+
+        with self._handles.open(self._get_zip_path(exp_id)) as handle:
+            yield handle
+
+    def _members(self, exp_id: str) -> Dict[str, List[zipfile.ZipInfo]]:
+        with self._open(exp_id) as handle:
+            return handle.members()
+
+    def _read_members(self, zf: zipfile.ZipFile, infos: List[zipfile.ZipInfo]):
+        values = [orjson.loads(zf.read(info)) for info in infos]
+
+        if len(values) == 1 and _member_field(infos[0].filename)[1] is None:
+            return values[0]
+
+        # a list member followed by chunks, or chunks only.
+        merged = []
+        for info, value in zip(infos, values):
+            if not isinstance(value, list):
+                field = _member_field(info.filename)[0]
+                raise ValueError(f"Field:{field} is not a list.")
+            merged.extend(value)
+        return merged
+
     def create(self, exp_id: str, force: bool = False, exists_ok=False):
         if not self.is_write_mode():
             raise ValueError("Write mode is not enabled.")
@@ -66,10 +495,9 @@ class ZipStorage(Storage):
         os.makedirs(os.path.dirname(zip_path), exist_ok=True)
 
         # Create empty zip file
-        with zipfile.ZipFile(
-            zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6
-        ) as _:
+        with zipfile.ZipFile(zip_path, "w") as _:
             pass
+        self._handles.invalidate(zip_path)
 
         return self.document(exp_id)
 
@@ -77,7 +505,13 @@ class ZipStorage(Storage):
         if not self.is_write_mode():
             raise ValueError("Write mode is not enabled.")
 
+        with self._pending_lock:
+            for key in [key for key in self._pending if key[0] == exp_id]:
+                self._pending_count -= len(self._pending.pop(key))
+            self._appenders.close(exp_id)
+
         zip_path = self._get_zip_path(exp_id)
+        self._handles.invalidate(zip_path)
         if os.path.exists(zip_path):
             os.remove(zip_path)
 
@@ -94,7 +528,7 @@ class ZipStorage(Storage):
         return [
             f.replace(".zip", "")
             for f in os.listdir(self.base_dir)
-            if f.endswith(".zip")
+            if f.endswith(".zip") and not f.startswith(".")
         ]
 
     def get(self, exp_id: str) -> dict:
@@ -102,26 +536,92 @@ class ZipStorage(Storage):
             raise ValueError("Read mode is not enabled.")
 
         data = {"_id": exp_id}
-        with zipfile.ZipFile(self._get_zip_path(exp_id), "r") as zf:
-            for filename in zf.namelist():
-                field = filename.replace(".json", "")
-                data[field] = self.read(exp_id, field)
+        with self._open(exp_id) as handle:
+            for field, infos in handle.members().items():
+                data[field] = self._read_members(handle.zf, infos)
         return data
 
     def read(self, exp_id: str, field: str):
         if not self.is_read_mode():
             raise ValueError("Read mode is not enabled.")
 
-        with zipfile.ZipFile(self._get_zip_path(exp_id), "r") as zf:
-            with zf.open(f"{field}.json") as f:
-                return orjson.loads(f.read())
+        with self._open(exp_id) as handle:
+            members = handle.members()
+            if field not in members:
+                raise KeyError(f"There is no item named '{field}.json' in the archive")
+
+            return self._read_members(handle.zf, members[field])
+
+    def iterable(
+        self,
+        exp_id: str,
+        field: str,
+        fields: List[str] = None,
+        where=None,
+    ):
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        if fields is not None or where is not None:
+            yield from select(self.iterable(exp_id, field), fields=fields, where=where)
+            return
+
+        with self._open(exp_id) as handle:
+            members = handle.members()
+            if field not in members:
+                raise KeyError(f"There is no item named '{field}.json' in the archive")
+
+            for info in members[field]:
+                with handle.zf.open(info) as f:
+                    if f.peek(64).lstrip()[:1] != b"[":
+                        if len(members[field]) > 1:
+                            raise ValueError(f"Field:{field} is not a list.")
+
+                        # not a list; iterate it like the decoded value.
+                        yield from orjson.loads(f.read())
+                    else:
+                        yield from iter_json_array(f, self.stream_decoder)
+
+    def is_list(self, exp_id: str, field: str) -> bool:
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        with self._open(exp_id) as handle:
+            members = handle.members()
+            if field not in members:
+                raise KeyError(f"There is no item named '{field}.json' in the archive")
+
+            # chunks only follow lists, so the first member decides.
+            with handle.zf.open(members[field][0]) as f:
+                return f.peek(64).lstrip()[:1] == b"["
+
+    def count(self, exp_id: str, field: str) -> int:
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        with self._open(exp_id) as handle:
+            members = handle.members()
+            if field not in members:
+                raise KeyError(f"There is no item named '{field}.json' in the archive")
+
+            count = 0
+            for info in members[field]:
+                with handle.zf.open(info) as f:
+                    count += count_json_array(f, self.stream_decoder)
+            return count
 
     def fields(self, exp_id: str) -> List[str]:
         if not self.is_read_mode():
             raise ValueError("Read mode is not enabled.")
 
-        with zipfile.ZipFile(self._get_zip_path(exp_id), "r") as zf:
-            return [f.replace(".json", "") for f in zf.namelist()]
+        return list(self._members(exp_id))
+
+    def field_version(self, exp_id: str, field: str):
+        if not self.is_read_mode():
+            raise ValueError("Read mode is not enabled.")
+
+        infos = self._members(exp_id)[field]
+        return f"{infos[-1].CRC}:{infos[-1].file_size}:{len(infos)}"
 
     def read_field_keys(self, exp_id: str, field: str) -> List[str]:
         if not self.is_read_mode():
@@ -141,13 +641,15 @@ class ZipStorage(Storage):
         if not self.is_write_mode():
             raise ValueError("Write mode is not enabled.")
 
-        with zipfile.ZipFile(
-            self._get_zip_path(exp_id),
-            "a",
-            compression=zipfile.ZIP_DEFLATED,
-            compresslevel=6,
-        ) as zf:
-            zf.writestr(f"{field}.json", orjson.dumps(data))
+        with self._pending_lock:
+            # buffered appends belong to the value being replaced.
+            self._pending_count -= len(self._pending.pop((exp_id, field), []))
+            self._appenders.close(exp_id)
+
+            with zipfile.ZipFile(self._get_zip_path(exp_id), "a") as zf:
+                write_member(zf, f"{field}.json", orjson.dumps(data), self.compression)
+
+        self._handles.invalidate(self._get_zip_path(exp_id))
 
     def write_subfield(self, exp_id: str, field: str, key: str, data: List[dict]):
         if not self.is_write_mode():
@@ -165,20 +667,55 @@ class ZipStorage(Storage):
         self.write(exp_id, field, existing_data)
 
     def append_subfield(self, exp_id: str, field: str, data: Any):
+        self.extend_subfield(exp_id, field, [data])
+
+    def extend_subfield(self, exp_id: str, field: str, data: List[Any]):
         if not self.is_write_mode():
             raise ValueError("Write mode is not enabled.")
 
         if not self.exists(exp_id):
             raise ValueError(f"Collection {exp_id} does not exist.")
 
-        try:
-            existing_data = self.read(exp_id, field)
-            if not isinstance(existing_data, list):
-                existing_data = []
-        except:
-            existing_data = []
+        with self._pending_lock:
+            self._pending.setdefault((exp_id, field), []).extend(data)
+            self._pending_count += len(data)
 
-        existing_data.append(data)
+            if self._pending_count >= self.append_buffer:
+                self._write_pending()
 
-        # Write back the entire field
-        self.write(exp_id, field, existing_data)
+    def vacuum(self, exp_ids: List[str] = None, recompress: bool = False):
+        """
+        Rewrite archives keeping only live members, one member per field.
+
+        Archives without superseded members are left alone unless `recompress`
+        is set, which rewrites every member with the current compression
+        policy. Each archive is written to a temporary file which then
+        replaces it.
+        """
+        if not self.is_write_mode():
+            raise ValueError("Write mode is not enabled.")
+
+        self.flush()
+
+        for exp_id in self.keys() if exp_ids is None else exp_ids:
+            zip_path = self._get_zip_path(exp_id)
+            tmp_path = f"{self.base_dir}/.{exp_id}.zip"
+
+            with zipfile.ZipFile(zip_path, "r") as zf:
+                members = live_members(zf)
+
+                compact = all(len(infos) == 1 for infos in members.values())
+                if not recompress and compact and len(members) == len(zf.infolist()):
+                    continue
+
+                with zipfile.ZipFile(tmp_path, "w") as out:
+                    for field, infos in members.items():
+                        if len(infos) == 1 and _member_field(infos[0].filename)[1] is None:
+                            payload = zf.read(infos[0])
+                        else:
+                            payload = orjson.dumps(self._read_members(zf, infos))
+
+                        write_member(out, f"{field}.json", payload, self.compression)
+
+            os.replace(tmp_path, zip_path)
+            self._handles.invalidate(zip_path)
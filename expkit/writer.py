@@ -0,0 +1,132 @@
+import queue
+import threading
+from typing import Any, Dict, Iterable, List
+
+from expkit.storage import StorageDocument
+
+_CLOSE = object()
+
+
+class InstanceWriter:
+    """
+    Write-behind writer for the instances of an experiment.
+
+    Instances are put on a bounded queue and written by a background thread in
+    batches of up to `batch_size` through `extend_subfield`, so storage latency
+    overlaps with whatever produces the instances. When `max_pending` instances
+    are waiting, `add_instance` blocks until the thread catches up.
+
+    A failed write is raised by the next `add_instance`, `flush` or `close`;
+    instances queued after the failure are dropped.
+    """
+
+    def __init__(
+        self,
+        document: StorageDocument,
+        field: str = "data",
+        batch_size: int = 256,
+        max_pending: int = 4096,
+        flush_interval: float = 1.0,
+    ):
+        self.document = document
+        self.field = field
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _write(self, batch: List[Any]):
+        if self._error is None and len(batch) > 0:
+            try:
+                self.document.extend_subfield(self.field, batch)
+            except BaseException as e:
+                self._error = e
+
+        for _ in batch:
+            self._queue.task_done()
+
+    def _run(self):
+        batch = []
+
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # idle; write whatever is pending.
+                self._write(batch)
+                batch = []
+                continue
+
+            if item is _CLOSE:
+                self._write(batch)
+                self._queue.task_done()
+                return
+
+            batch.append(item)
+
+            if len(batch) >= self.batch_size or self._queue.empty():
+                self._write(batch)
+                batch = []
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Failed to write instances: {error}") from error
+
+    def put(self, instance: Any):
+        if self._closed:
+            raise ValueError("Writer is closed.")
+
+        self._raise_error()
+        self._queue.put(instance)
+
+    def add_instance(
+        self,
+        input: Dict[str, Any],
+        outputs: List[Dict[str, Any]],
+    ):
+        self.put({"input": input, "outputs": outputs})
+
+    def add_instances(
+        self,
+        inputs: Iterable[Dict[str, Any]],
+        outputs: Iterable[List[Dict[str, Any]]],
+    ):
+        for input_data, output in zip(inputs, outputs):
+            self.add_instance(input_data, output)
+
+    def extend(self, instances: Iterable[Any]):
+        """Queue every instance of an iterable (e.g. a generator)."""
+        for instance in instances:
+            self.put(instance)
+
+    def flush(self):
+        """Wait until every queued instance is written."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep the original exception; still write what was queued.
+            try:
+                self.close()
+            except RuntimeError:
+                pass
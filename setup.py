@@ -17,6 +17,7 @@ setuptools.setup(
     url="https://github.com/goncalorafaria/expkit-core",
     packages=setuptools.find_packages(),
     install_requires=installation_requirements,
+    extras_require={"compression": ["zstandard", "lz4"], "test": ["mongomock"]},
     python_requires=">=3.6.0",
     classifiers=[
         "Programming Language :: Python :: 3",
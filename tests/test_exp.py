@@ -37,6 +37,20 @@ class TestExp(unittest.TestCase):
         self.assertEqual(exp.instances[1].input_data, inputs[1])
         self.assertEqual(exp.instances[1].outputs, outputs[1])
 
+    def test_writer(self):
+        # Test writing instances through the background writer
+        exp = Exp("TestExp", {"author": "John Doe"})
+        inputs = [{"input": i} for i in range(10)]
+        outputs = [[{"output": i}] for i in range(10)]
+
+        with exp.writer(batch_size=3, max_pending=4) as writer:
+            writer.add_instances(inputs, outputs)
+
+        self.assertEqual(
+            exp.instances(),
+            [{"input": i, "outputs": o} for i, o in zip(inputs, outputs)],
+        )
+
     def test_save_and_load(self):
         base_dir = "data/"
         # Test saving and loading an Exp instance
@@ -1,6 +1,24 @@
 import unittest
+from unittest import mock
+
+import numpy as np
+
 from expkit.pexp import PExp
-from expkit.ops import Operation
+from expkit.ops import (
+    EvalMax,
+    EvalMeanLast,
+    EvalMeanMax,
+    EvalReduceOperation,
+    EvalTotalMean,
+    Operation,
+)
+from expkit.storage import MemoryStorage
+from expkit.storage.mongo import MongoInstanceStorage
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
 
 import os
 
@@ -47,6 +65,42 @@ class TestPExp(unittest.TestCase):
         self.assertEqual(result, 2)
         # 2
 
+    @unittest.skipIf(mongomock is None, "mongomock is not installed")
+    def test_eval_reduce(self):
+        ops = {
+            "mean": EvalTotalMean(entry_key="scores", eval_key="r", n=2),
+            "max": EvalMax(entry_key="scores", eval_key="r"),
+            "last": EvalMeanLast(entry_key="scores", eval_key="r", n=1),
+            "sum": EvalReduceOperation(np.sum, entry_key="scores", eval_key="r"),
+            "tail": EvalMeanMax(entry_key="scores", eval_key="r", n=-1),
+        }
+        evals = [{"scores": [1, True, 3.5]}, {"scores": [3, False, 4]}]
+
+        # client side, the storage cannot reduce.
+        exp = PExp(ops=ops, name="TestExp", meta={}, storage=MemoryStorage("rw"))
+        exp.add_eval("r", evals)
+        exp.run_ops()
+        expected = exp.ops_results
+
+        with mongomock.patch(servers=(("localhost", 27017),)):
+            storage = MongoInstanceStorage("mongodb://localhost:27017", "rw")
+            reduce, pushed = storage.reduce, []
+
+            def pushdown(*args, **kwargs):
+                result = reduce(*args, **kwargs)
+                pushed.append(result)
+                return result
+
+            with mock.patch.object(storage, "reduce", pushdown):
+                exp = PExp(ops=ops, name="TestExp", meta={}, storage=storage)
+                exp.add_eval("r", evals)
+                exp.run_ops()
+
+            # the aggregation pipeline agrees with `apply` on the same data;
+            # only the negative slice ran on the client.
+            self.assertEqual(exp.ops_results, expected)
+            self.assertEqual(len(pushed), 4)
+
     def test_save_and_load(self):
         base_dir = "/tmp/"
         ops = {"op1": Operation.data(len), "op2": Operation.data(len)}
@@ -0,0 +1,1155 @@
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from functools import partial
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import zipfile
+
+from expkit.exp import Exp
+from expkit.setup import ExpSetup
+from expkit.storage import (
+    DiskStorage,
+    MemoryStorage,
+    MongoInstanceStorage,
+    MongoStorage,
+    SharedCachedRO,
+    ZipStorage,
+)
+from expkit.storage.base import Storage
+from expkit.storage.disk import mapped, zstandard
+from expkit.storage.jsonstream import iter_orjson_array
+from expkit.storage.migrate import copy_field
+from expkit.storage.mongo import LAYOUT_KEY, NATIVE, encode_mongo_format
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+MONGO_URI = "mongodb://localhost:27017"
+
+
+def start_mongomock(test: unittest.TestCase):
+    """Serve MONGO_URI from mongomock for the duration of `test`."""
+    from mongomock import aggregate
+    from mongomock.collection import BulkOperationBuilder
+    from mongomock.database import Database
+
+    def drop_sort(method):
+        # pymongo >= 4.11 passes a `sort` the mongomock bulk builder lacks.
+        def add(self, *args, sort=None, **kwargs):
+            return method(self, *args, **kwargs)
+
+        return add
+
+    def union_with(in_collection, database, options):
+        other = database.get_collection(options["coll"])
+        return list(in_collection) + list(other.aggregate(options.get("pipeline", [])))
+
+    list_collection_names = Database.list_collection_names
+
+    def list_named(self, filter=None, session=None):
+        # filtered listings of mongomock still include dropped collections.
+        names = list_collection_names(self, session=session)
+        return names if filter is None else [n for n in names if n == filter["name"]]
+
+    patchers = [
+        mongomock.patch(servers=(("localhost", 27017),)),
+        mock.patch.dict(aggregate._PIPELINE_HANDLERS, {"$unionWith": union_with}),
+        mock.patch.object(Database, "list_collection_names", list_named),
+    ]
+    for name in ("add_update", "add_replace"):
+        method = getattr(BulkOperationBuilder, name)
+        patchers.append(mock.patch.object(BulkOperationBuilder, name, drop_sort(method)))
+
+    for patcher in patchers:
+        patcher.start()
+        test.addCleanup(patcher.stop)
+
+
+class TestSharedCachedRO(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+
+        storage = DiskStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.write("exp1", "data", [{"input": 1}, {"input": 2}])
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def test_shared_between_instances(self):
+        cache = SharedCachedRO(DiskStorage(self.base_dir, "r"), cache_dir=self.cache_dir)
+        self.assertEqual(cache.read("exp1", "data"), [{"input": 1}, {"input": 2}])
+
+        # a second cache over the same source (e.g. another worker) reuses the entry.
+        other = SharedCachedRO(DiskStorage(self.base_dir, "r"), cache_dir=self.cache_dir)
+        with mock.patch.object(other.source_storage, "read", side_effect=AssertionError):
+            self.assertEqual(other.read("exp1", "data"), [{"input": 1}, {"input": 2}])
+
+        other.clear()
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+
+    def test_stale_entries(self):
+        cache = SharedCachedRO(DiskStorage(self.base_dir, "r"), cache_dir=self.cache_dir)
+        self.assertEqual(cache.read("exp1", "data"), [{"input": 1}, {"input": 2}])
+
+        DiskStorage(self.base_dir, "rw").write("exp1", "data", [{"input": 3}])
+        self.assertEqual(cache.read("exp1", "data"), [{"input": 3}])
+
+    def test_concurrent_publish(self):
+        cache = SharedCachedRO(DiskStorage(self.base_dir, "r"), cache_dir=self.cache_dir)
+        barrier = threading.Barrier(8)
+        replace = os.replace
+
+        def publish_together(src, dst):
+            # every thread has written its entry before any of them renames.
+            barrier.wait(5)
+            replace(src, dst)
+
+        with mock.patch("expkit.storage.cache.os.replace", side_effect=publish_together):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                results = list(
+                    pool.map(lambda _: cache.read("exp1", "data"), range(8))
+                )
+
+        self.assertEqual(results, [[{"input": 1}, {"input": 2}]] * 8)
+        self.assertEqual(len(os.listdir(cache.cache_dir)), 1)
+
+    def test_namespace(self):
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.base_dir)
+            cache = SharedCachedRO(DiskStorage(".", "r"), cache_dir=self.cache_dir)
+            os.chdir(self.cache_dir)
+            other = SharedCachedRO(DiskStorage(self.base_dir, "r"), cache_dir=self.cache_dir)
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(cache.cache_dir, other.cache_dir)
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_orjson_array_chunks(self):
+        data = [
+            {"text": 'quote " and ] bracket, comma', "scores": [1, 2.5, None]},
+            [[], {}, [{"a": "\\"}]],
+            "plain \\",
+            3,
+            {"nested": {"deep": [{"x": "}{"}]}},
+        ]
+        raw = json.dumps(data, indent=1).encode()
+
+        for chunk_size in (1, 2, 5, 1 << 20):
+            self.assertEqual(
+                list(iter_orjson_array(io.BytesIO(raw), chunk_size=chunk_size)), data
+            )
+
+        self.assertEqual(list(iter_orjson_array(io.BytesIO(b"[ ]"))), [])
+        self.assertEqual(list(iter_orjson_array(io.BytesIO(b'{"a": 1}'))), [])
+
+        with self.assertRaises(ValueError):
+            list(iter_orjson_array(io.BytesIO(b'[1, {"a": ')))
+
+
+class TestDiskStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_jsonl_list_format(self):
+        storage = DiskStorage(self.base_dir, "rw", list_format="jsonl")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.extend_subfield("exp1", "data", [{"i": 0}, {"i": 1}])
+        storage.append_subfield("exp1", "data", {"i": 2})
+
+        data = [{"i": 0}, {"i": 1}, {"i": 2}]
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.base_dir, "exp1"))),
+            ["data.jsonl", "meta.json"],
+        )
+        self.assertEqual(storage.read("exp1", "data"), data)
+        self.assertEqual(list(storage.iterable("exp1", "data")), data)
+
+        storage.convert("json")
+        self.assertEqual(sorted(storage.fields("exp1")), ["data", "meta"])
+        self.assertEqual(storage.read("exp1", "data"), data)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.base_dir, "exp1", "data.json"))
+        )
+
+    def test_failed_rewrite(self):
+        storage = DiskStorage(self.base_dir, "rw", list_format="jsonl")
+        storage.create("exp1")
+        storage.extend_subfield("exp1", "data", [{"i": 0}, {"i": 1}])
+
+        def broken(file_path):
+            yield {"i": 0}
+            raise OSError("disk full")
+
+        with mock.patch.object(storage, "_iter_file", side_effect=broken):
+            with self.assertRaises(OSError):
+                storage.convert("json")
+
+        self.assertEqual(os.listdir(os.path.join(self.base_dir, "exp1")), ["data.jsonl"])
+        self.assertEqual(storage.read("exp1", "data"), [{"i": 0}, {"i": 1}])
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_view(self):
+        storage = DiskStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+
+        with storage.view("exp1", "meta") as raw:
+            self.assertTrue(raw.readonly)
+            self.assertEqual(json.loads(bytes(raw)), {"name": "test1"})
+
+            # a rewrite does not pull the mapped file from under the view.
+            storage.write("exp1", "meta", {})
+            self.assertEqual(json.loads(bytes(raw)), {"name": "test1"})
+
+        self.assertEqual(storage.read("exp1", "meta"), {})
+        self.assertEqual(os.listdir(os.path.join(self.base_dir, "exp1")), ["meta.json"])
+
+        # appends to a JSON array patch the mapped file in place.
+        storage.write("exp1", "data", [1, 2])
+        with storage.view("exp1", "data") as raw:
+            storage.extend_subfield("exp1", "data", [3])
+            self.assertEqual(bytes(raw), b"[1,2,")
+
+        empty_path = os.path.join(self.base_dir, "empty")
+        open(empty_path, "wb").close()
+        with mapped(empty_path) as mm:
+            self.assertEqual(bytes(mm), b"")
+
+    def test_read_during_append(self):
+        storage = DiskStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "data", [1, 2])
+        file_path = os.path.join(self.base_dir, "exp1", "data.json")
+
+        # the first map is taken halfway through an append.
+        @contextlib.contextmanager
+        def torn(path):
+            mock_mapped.side_effect = mapped
+            storage.extend_subfield("exp1", "data", [3])
+            yield b"[1,2,"
+
+        with mock.patch("expkit.storage.disk.mapped", side_effect=torn) as mock_mapped:
+            self.assertEqual(storage.read("exp1", "data"), [1, 2, 3])
+
+        # a file that stays broken is an error.
+        with open(file_path, "wb") as f:
+            f.write(b"[1,2,")
+        with self.assertRaises(ValueError):
+            storage.read("exp1", "data")
+
+    def test_zstd_compression(self):
+        storage = DiskStorage(self.base_dir, "rw", compression="zstd")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.write("exp1", "data", [{"i": 0}])
+        storage.append_subfield("exp1", "data", {"i": 1})
+        storage.append_subfield("exp1", "data", {"i": 2})
+
+        data = [{"i": 0}, {"i": 1}, {"i": 2}]
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.base_dir, "exp1"))),
+            ["data.jsonl.zst", "meta.json.zst"],
+        )
+        self.assertEqual(storage.read("exp1", "data"), data)
+        self.assertEqual(list(storage.iterable("exp1", "data")), data)
+
+        # plain storages read compressed fields and can convert them back.
+        plain = DiskStorage(self.base_dir, "rw")
+        self.assertEqual(plain.read("exp1", "meta"), {"name": "test1"})
+        plain.convert()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.base_dir, "exp1"))),
+            ["data.json", "meta.json"],
+        )
+        self.assertEqual(plain.read("exp1", "data"), data)
+
+    def test_projection(self):
+        data = [
+            {
+                "input": {"prompt": "a", "id": 0},
+                "outputs": [{"text": "x", "logprobs": [0.1]}],
+            },
+            {"input": {"prompt": "b", "id": 1}, "outputs": []},
+        ]
+        expected = [
+            {"input": {"prompt": "a"}, "outputs": [{"text": "x"}]},
+            {"input": {"prompt": "b"}, "outputs": []},
+        ]
+
+        for storage in (DiskStorage(self.base_dir, "rw"), MemoryStorage("rw")):
+            storage.create("exp1")
+            storage.write("exp1", "meta", {})
+            storage.write("exp1", "data", data)
+
+            exp = Exp(document=storage.document("exp1"))
+            self.assertEqual(exp.instances(fields=["input.prompt", "outputs.text"]), expected)
+            self.assertEqual(exp.instances(fields=["missing"]), [{}, {}])
+
+    def test_where_and_sample(self):
+        data = [{"i": i, "input": {"split": i % 2}} for i in range(50)]
+
+        for list_format in ("json", "jsonl"):
+            base_dir = os.path.join(self.base_dir, list_format)
+            os.makedirs(base_dir)
+            storage = DiskStorage(base_dir, "rw", list_format=list_format)
+            storage.create("exp1")
+            storage.write("exp1", "meta", {})
+            storage.extend_subfield("exp1", "data", data)
+
+            exp = Exp(document=storage.document("exp1"))
+            odd = exp.instances(where={"input.split": 1}, fields=["i"])
+            self.assertEqual(odd, [{"i": i} for i in range(1, 50, 2)])
+
+            sample = exp.instances(sample=5, seed=0)
+            self.assertEqual(len(sample), 5)
+            self.assertEqual(sample, sorted(sample, key=lambda d: d["i"]))
+            self.assertTrue(all(d in data for d in sample))
+            self.assertEqual(exp.instances(sample=5, seed=0), sample)
+            self.assertEqual(len(exp.instances(sample=100)), 50)
+
+            sample = exp.instances(sample=3, where=lambda d: d["i"] < 10)
+            self.assertTrue(all(d["i"] < 10 for d in sample))
+
+    def test_rewrite_then_count_and_sample(self):
+        storage = DiskStorage(self.base_dir, "rw", list_format="jsonl")
+        storage.create("exp1")
+        storage.write("exp1", "data", [{"i": i} for i in range(10)])
+        self.assertEqual(storage.count("exp1", "data"), 10)
+        self.assertEqual(len(storage.sample("exp1", "data", 4, seed=0)), 4)
+
+        # longer records, then fewer records written by another instance.
+        longer = [{"i": i, "text": "x" * 100} for i in range(10)]
+        storage.write("exp1", "data", longer)
+        self.assertEqual(storage.count("exp1", "data"), 10)
+        self.assertEqual(storage.sample("exp1", "data", 10, seed=0), longer)
+
+        other = DiskStorage(self.base_dir, "rw", list_format="jsonl")
+        other.write("exp1", "data", longer[:3])
+        self.assertEqual(storage.count("exp1", "data"), 3)
+        self.assertEqual(storage.sample("exp1", "data", 5, seed=0), longer[:3])
+
+        storage.append_subfield("exp1", "data", {"i": 3})
+        self.assertEqual(storage.count("exp1", "data"), 4)
+
+    def test_writer_segments(self):
+        DiskStorage(self.base_dir, "rw").create("exp1")
+
+        writers = [DiskStorage(self.base_dir, "rw", writer=f"w{w}") for w in range(2)]
+        for w, storage in enumerate(writers):
+            storage.write("exp1", "meta", {})
+            storage.extend_subfield("exp1", "data", [{"w": w, "i": i} for i in range(3)])
+
+        data = [{"w": w, "i": i} for w in range(2) for i in range(3)]
+
+        storage = DiskStorage(self.base_dir, "rw")
+        self.assertEqual(sorted(storage.fields("exp1")), ["data", "meta"])
+        self.assertEqual(storage.read("exp1", "data"), data)
+        self.assertEqual(list(storage.iterable("exp1", "data")), data)
+        self.assertEqual(len(Exp(document=storage.document("exp1"))), 6)
+
+        storage.compact()
+        self.assertEqual(
+            sorted(f for f in os.listdir(os.path.join(self.base_dir, "exp1")) if f[0] != "."),
+            ["data.json", "meta.json"],
+        )
+        self.assertEqual(storage.read("exp1", "data"), data)
+
+    def test_group_commit(self):
+        synced = []
+        with mock.patch(
+            "expkit.storage.durability.fsync_path",
+            lambda path, directory=False: synced.append(path),
+        ):
+            with DiskStorage(
+                self.base_dir, "rw", layout="sharded", durability={"records": 2}
+            ) as storage:
+                storage.create("exp1")
+                for i in range(3):
+                    storage.append_subfield("exp1", "data", {"i": i})
+
+                    if i == 0:
+                        self.assertEqual(synced, [])
+
+                # the second append synced the file and the new directories.
+                data_path = storage._field_path("exp1", "data")
+                exp_path = os.path.dirname(data_path)
+                self.assertEqual(
+                    sorted(synced),
+                    sorted(
+                        [
+                            data_path,
+                            exp_path,
+                            os.path.dirname(exp_path),
+                            os.path.dirname(os.path.dirname(exp_path)),
+                            self.base_dir,
+                        ]
+                    ),
+                )
+                del synced[:]
+
+            # the third is synced on close.
+            self.assertEqual(synced, [data_path])
+
+        self.assertEqual(storage.read("exp1", "data"), [{"i": i} for i in range(3)])
+
+    def test_group_commit_copy(self):
+        storage = DiskStorage(self.base_dir, "rw", durability={"interval_ms": 10})
+        storage.create("exp1")
+        storage.append_subfield("exp1", "data", {"i": 0})
+
+        copied = copy.deepcopy(storage)
+        copied.append_subfield("exp1", "data", {"i": 1})
+        self.assertEqual(storage.read("exp1", "data"), [{"i": 0}, {"i": 1}])
+
+        # the interval threads end with the storages, closed or not.
+        threads = [storage._durability._thread, copied._durability._thread]
+        storage.close()
+        del copied
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+
+    def test_sharded_layout(self):
+        storage = DiskStorage(self.base_dir, "rw", layout="sharded")
+        for i in range(5):
+            storage.create(f"exp{i}")
+            storage.write(f"exp{i}", "meta", {"name": f"test{i}"})
+
+        self.assertEqual(sorted(storage.keys()), [f"exp{i}" for i in range(5)])
+        self.assertNotIn("exp0", os.listdir(self.base_dir))
+        self.assertEqual(storage.read("exp3", "meta"), {"name": "test3"})
+
+        storage.reshard("flat")
+        self.assertEqual(sorted(os.listdir(self.base_dir)), sorted(storage.keys()))
+        self.assertEqual(DiskStorage(self.base_dir).read("exp3", "meta"), {"name": "test3"})
+
+        storage.reshard("sharded")
+        self.assertEqual(len(storage.keys()), 5)
+        self.assertTrue(all(len(name) == 2 for name in os.listdir(self.base_dir)))
+
+        # the layout of an existing tree is detected.
+        detected = DiskStorage(self.base_dir)
+        self.assertEqual(detected.layout, "sharded")
+        self.assertEqual(sorted(detected.keys()), [f"exp{i}" for i in range(5)])
+
+        # and an explicit layout has to match it.
+        with self.assertRaises(ValueError):
+            DiskStorage(self.base_dir, layout="flat")
+        storage.reshard("flat")
+        with self.assertRaises(ValueError):
+            DiskStorage(self.base_dir, layout="sharded")
+        self.assertEqual(DiskStorage(self.base_dir, layout="flat").layout, "flat")
+
+    def test_resume_reshard(self):
+        # two hex digit names look like shard directories.
+        names = ["3e", "ab", "exp0", "exp1", "exp2"]
+
+        storage = DiskStorage(self.base_dir, "rw")
+        for name in names:
+            storage.create(name)
+            storage.write(name, "meta", {"name": name})
+
+        # interrupted after moving some experiments.
+        for name in ("3e", "exp1"):
+            sharded_path = storage._dir_path(name, "sharded")
+            os.makedirs(os.path.dirname(sharded_path), exist_ok=True)
+            os.rename(storage._dir_path(name), sharded_path)
+        self.assertEqual(sorted(storage.keys()), names)
+
+        for layout in ("sharded", "flat", "sharded", "flat"):
+            DiskStorage(self.base_dir, "rw").reshard(layout)
+
+            storage = DiskStorage(self.base_dir, "rw")
+            self.assertEqual(storage.layout, layout)
+            self.assertEqual(sorted(storage.keys()), names)
+            for name in names:
+                self.assertEqual(storage.read(name, "meta"), {"name": name})
+
+        self.assertEqual(sorted(os.listdir(self.base_dir)), names)
+
+
+class TestZipStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_chunked_appends(self):
+        storage = ZipStorage(self.base_dir, "rw", append_buffer=4)
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.write("exp1", "data", [{"i": 0}])
+        for i in range(1, 10):
+            storage.append_subfield("exp1", "data", {"i": i})
+
+        data = [{"i": i} for i in range(10)]
+        self.assertEqual(storage.read("exp1", "data"), data)
+        self.assertEqual(sorted(storage.fields("exp1")), ["data", "meta"])
+
+        # a rewrite hides the chunks appended before it.
+        storage.write("exp1", "data", data[:2])
+        storage.append_subfield("exp1", "data", {"i": 2})
+        self.assertEqual(storage.read("exp1", "data"), data[:3])
+
+        storage.vacuum()
+        with zipfile.ZipFile(os.path.join(self.base_dir, "exp1.zip")) as zf:
+            self.assertEqual(sorted(zf.namelist()), ["data.json", "meta.json"])
+        self.assertEqual(storage.get("exp1")["data"], data[:3])
+
+        # chunks appended to a non-list field are not merged into it.
+        storage.append_subfield("exp1", "meta", {"i": 0})
+        with self.assertRaises(ValueError):
+            storage.read("exp1", "meta")
+        with self.assertRaises(ValueError):
+            list(storage.iterable("exp1", "meta"))
+
+    def test_deepcopy(self):
+        storage = ZipStorage(self.base_dir, "rw", append_buffer=100)
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.extend_subfield("exp1", "data", [{"i": 0}, {"i": 1}])
+        storage.read("exp1", "meta")  # keeps an open handle
+
+        copied = copy.deepcopy(storage)
+        self.assertEqual(copied.read("exp1", "data"), [{"i": 0}, {"i": 1}])
+
+        copied.append_subfield("exp1", "data", {"i": 2})
+        storage.append_subfield("exp1", "data", {"i": 3})
+        copied.flush()
+        self.assertEqual(
+            storage.read("exp1", "data"), [{"i": i} for i in (0, 1, 2, 3)]
+        )
+
+        setup = ExpSetup(storage).query({"name": "exp1"})
+        self.assertEqual(len(setup), 1)
+
+    def test_pickle_handle_pool(self):
+        storage = ZipStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.read("exp1", "meta")
+        self.assertEqual(len(storage._handles._handles), 1)
+
+        copied = pickle.loads(pickle.dumps(storage))
+        self.assertEqual(len(copied._handles._handles), 0)
+        self.assertEqual(copied._handles.maxsize, storage._handles.maxsize)
+        self.assertEqual(copied.read("exp1", "meta"), {"name": "test1"})
+
+    def test_pooled_handles(self):
+        storage = ZipStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        self.assertEqual(storage.read("exp1", "meta"), {"name": "test1"})
+
+        with storage._handles.open(storage._get_zip_path("exp1")) as first:
+            pass
+        storage.read("exp1", "meta")
+        with storage._handles.open(storage._get_zip_path("exp1")) as second:
+            self.assertIs(first, second)
+
+        # a write from another storage is picked up through the mtime check.
+        ZipStorage(self.base_dir, "rw").write("exp1", "meta", {"name": "test2"})
+        self.assertEqual(storage.read("exp1", "meta"), {"name": "test2"})
+        self.assertTrue(first.stale)
+
+    def test_streaming_iterable(self):
+        storage = ZipStorage(self.base_dir, "rw", append_buffer=2)
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.write("exp1", "data", [{"i": 0}])
+        storage.extend_subfield("exp1", "data", [{"i": 1}, {"i": 2}, {"i": 3}])
+
+        data = [{"i": i} for i in range(4)]
+        self.assertEqual(list(storage.iterable("exp1", "data")), data)
+        self.assertEqual(storage.count("exp1", "data"), 4)
+        self.assertEqual(len(Exp(document=storage.document("exp1"))), 4)
+
+    def test_compression_policy(self):
+        policy = {
+            "fields": {"data": ("lzma", None), "eval_*": ("stored", None)},
+            "min_size": 64,
+        }
+        storage = ZipStorage(self.base_dir, "rw", compression=policy)
+        storage.create("exp1")
+        storage.write("exp1", "meta", {"name": "test1"})
+        storage.write("exp1", "data", [{"text": "x" * 100}])
+        storage.write("exp1", "eval_score", [0.5] * 100)
+
+        with zipfile.ZipFile(os.path.join(self.base_dir, "exp1.zip")) as zf:
+            types = {info.filename: info.compress_type for info in zf.infolist()}
+        self.assertEqual(
+            types,
+            {
+                "meta.json": zipfile.ZIP_STORED,
+                "data.json": zipfile.ZIP_LZMA,
+                "eval_score.json": zipfile.ZIP_STORED,
+            },
+        )
+        self.assertEqual(storage.read("exp1", "data"), [{"text": "x" * 100}])
+
+    def test_flush_on_close(self):
+        with ZipStorage(self.base_dir, "rw", append_buffer=100) as storage:
+            storage.create("exp1")
+            storage.extend_subfield("exp1", "data", [{"i": 0}, {"i": 1}])
+
+        storage = ZipStorage(self.base_dir, "r")
+        self.assertEqual(storage.read("exp1", "data"), [{"i": 0}, {"i": 1}])
+
+    def test_append_cost(self):
+        storage = ZipStorage(self.base_dir, "rw")
+        storage.create("exp1")
+        storage.write("exp1", "data", [])
+
+        # the central directory is parsed and written once, however many
+        # chunk members the appends add.
+        parse = mock.patch.object(
+            zipfile.ZipFile,
+            "_RealGetContents",
+            autospec=True,
+            side_effect=zipfile.ZipFile._RealGetContents,
+        )
+        end = mock.patch.object(
+            zipfile.ZipFile,
+            "_write_end_record",
+            autospec=True,
+            side_effect=zipfile.ZipFile._write_end_record,
+        )
+        with parse as parsed, end as ended:
+            for i in range(1000):
+                storage.append_subfield("exp1", "data", {"i": i})
+            self.assertEqual(parsed.call_count, 1)
+            self.assertEqual(ended.call_count, 0)
+
+            storage.flush()
+            self.assertEqual(ended.call_count, 1)
+
+        self.assertEqual(storage.read("exp1", "data"), [{"i": i} for i in range(1000)])
+        self.assertEqual(storage.count("exp1", "data"), 1000)
+
+
+class TestMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.target_dir = tempfile.mkdtemp()
+
+        self.storage = DiskStorage(self.base_dir, "rw")
+        for i in range(3):
+            self.storage.create(f"exp{i}")
+            self.storage.write(f"exp{i}", "meta", {"i": i})
+            self.storage.extend_subfield(
+                f"exp{i}", "data", [{"input": j} for j in range(5)]
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        shutil.rmtree(self.target_dir)
+
+    def test_to_zip(self):
+        target = ZipStorage(self.target_dir, "rw")
+        stats = self.storage.to(target, workers=2, chunk_size=2)
+
+        self.assertEqual(stats["documents"], 3)
+        self.assertEqual(stats["records"], 3 * 6)
+        # the JSON size of the meta and of each chunk of two elements.
+        size = len(b'{"i":0}') + 2 * len(b'[{"input":0},{"input":1}]')
+        self.assertEqual(stats["bytes"], 3 * (size + len(b'[{"input":4}]')))
+        self.assertGreater(stats["bytes_per_s"], 0)
+        for i in range(3):
+            self.assertEqual(target.read(f"exp{i}", "meta"), {"i": i})
+            self.assertEqual(
+                target.read(f"exp{i}", "data"), [{"input": j} for j in range(5)]
+            )
+
+    def test_resume_from_journal(self):
+        journal = os.path.join(self.target_dir, "journal.txt")
+        with open(journal, "w") as f:
+            f.write("exp0\n")
+
+        target = MemoryStorage("rw")
+        stats = self.storage.to(target, journal=journal)
+
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(sorted(target.keys()), ["exp1", "exp2"])
+        with open(journal) as f:
+            self.assertEqual(sorted(f.read().split()), ["exp0", "exp1", "exp2"])
+
+    def test_float_round_trip(self):
+        data = [{"x": i + 0.5, "y": [0.25, 1e-3]} for i in range(4)]
+        storage = DiskStorage(self.target_dir, "rw")
+        storage.create("exp0")
+        storage.write("exp0", "data", data[:2])
+
+        # compacting and converting stream the JSON array back in.
+        DiskStorage(self.target_dir, "rw", writer="w1").extend_subfield(
+            "exp0", "data", data[2:]
+        )
+        storage.compact()
+        self.assertEqual(storage.read("exp0", "data"), data)
+        storage.convert("jsonl")
+        self.assertEqual(storage.read("exp0", "data"), data)
+        storage.convert("json")
+
+        for element in storage.iterable("exp0", "data"):
+            self.assertIsInstance(element["x"], float)
+
+        target = ZipStorage(tempfile.mkdtemp(), "rw")
+        self.addCleanup(shutil.rmtree, target.base_dir)
+        self.assertEqual(storage.to(target)["failed"], [])
+        self.assertEqual(list(target.iterable("exp0", "data")), data)
+
+        mirror = MemoryStorage("rw")
+        storage.sync(mirror, state=os.path.join(target.base_dir, "sync.json"))
+        self.assertEqual(mirror.read("exp0", "data"), data)
+
+    def test_copy_reads_once(self):
+        source = MemoryStorage("rw")
+        source.create("exp0")
+        source.write("exp0", "meta", {"i": 0})
+        source.write("exp0", "data", [{"input": j} for j in range(5)])
+
+        # the generic is_list would read the field a second time.
+        target = ZipStorage(self.target_dir, "rw")
+        target.create("exp0")
+        with mock.patch.object(source, "read", wraps=source.read) as read:
+            self.assertEqual(copy_field(source, target, "exp0", "data", chunk_size=2)[0], 5)
+            self.assertEqual(copy_field(source, target, "exp0", "meta"), (1, 7))
+        self.assertEqual(read.call_count, 2)
+
+        # storages that tell lists cheaply stream them instead.
+        mirror = MemoryStorage("rw")
+        mirror.create("exp0")
+        with mock.patch.object(target, "read", side_effect=AssertionError):
+            self.assertEqual(copy_field(target, mirror, "exp0", "data")[0], 5)
+        self.assertEqual(target.read("exp0", "data"), [{"input": j} for j in range(5)])
+        self.assertFalse(target.is_list("exp0", "meta"))
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.state = os.path.join(tempfile.mkdtemp(), "sync.json")
+
+        self.storage = DiskStorage(self.base_dir, "rw")
+        for i in range(3):
+            self.storage.create(f"exp{i}")
+            self.storage.write(f"exp{i}", "meta", {"i": i})
+            self.storage.extend_subfield(
+                f"exp{i}", "data", [{"input": j} for j in range(5)]
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+        shutil.rmtree(os.path.dirname(self.state))
+
+    def test_incremental_sync(self):
+        target = MemoryStorage("rw")
+
+        self.storage.sync(target, state=self.state)
+        self.storage.append_subfield("exp0", "data", {"input": 5})
+        stats = self.storage.sync(target, state=self.state)
+
+        self.assertEqual(stats["records"], 1)
+        self.assertEqual(
+            target.read("exp0", "data"), [{"input": j} for j in range(6)]
+        )
+        self.assertEqual(target.read("exp1", "meta"), {"i": 1})
+
+    def test_resume_after_failure(self):
+        target = MemoryStorage("rw")
+        self.storage.sync(target, state=self.state)
+
+        self.storage.extend_subfield("exp0", "data", [{"input": 5}, {"input": 6}])
+
+        # the tail reaches the target, then the document fails.
+        extend_subfield = target.extend_subfield
+
+        def fail_after_extend(*args):
+            extend_subfield(*args)
+            raise RuntimeError("target unavailable")
+
+        with mock.patch.object(target, "extend_subfield", fail_after_extend):
+            with self.assertRaises(RuntimeError):
+                self.storage.sync(target, state=self.state)
+        self.assertEqual(len(target.read("exp0", "data")), 7)
+
+        stats = self.storage.sync(target, state=self.state)
+
+        self.assertEqual(stats["records"], 0)
+        self.assertEqual(
+            target.read("exp0", "data"), [{"input": j} for j in range(7)]
+        )
+
+    def test_resume_point(self):
+        source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source_dir)
+        target_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target_dir)
+
+        source = DiskStorage(source_dir, "rw", list_format="jsonl")
+        for i in range(2):
+            source.create(f"exp{i}")
+            source.extend_subfield(f"exp{i}", "data", [{"input": j} for j in range(5)])
+        target = ZipStorage(target_dir, "rw")
+        source.sync(target, state=self.state)
+
+        # a grown list is resumed without reading either copy in full.
+        source.append_subfield("exp0", "data", {"input": 5})
+        with contextlib.ExitStack() as stack:
+            for storage, method in [
+                (source, "iterable"),
+                (target, "iterable"),
+                (target, "count"),
+            ]:
+                stack.enter_context(
+                    mock.patch.object(storage, method, side_effect=AssertionError)
+                )
+            stats = source.sync(target, state=self.state)
+
+        self.assertEqual(stats["records"], 1)
+        self.assertEqual(target.read("exp0", "data"), [{"input": j} for j in range(6)])
+
+        # a list whose copied part changed is rewritten.
+        source.write("exp1", "data", [{"input": -j} for j in range(6)])
+        stats = source.sync(target, state=self.state)
+
+        self.assertEqual(stats["records"], 6)
+        self.assertEqual(target.read("exp1", "data"), [{"input": -j} for j in range(6)])
+
+
+
+class TestStorageQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+        self.storage = DiskStorage(self.base_dir, "rw")
+        for i in range(3):
+            self.storage.create(f"exp{i}")
+            self.storage.write(f"exp{i}", "meta", {"i": i})
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_find(self):
+        self.assertEqual(self.storage.find({"i": 1}), {"exp1": {"i": 1}})
+        self.assertEqual(self.storage.find({"name": "exp2"}), {"exp2": {"i": 2}})
+        self.assertEqual(len(self.storage.find()), 3)
+
+        setup = ExpSetup(self.storage, criteria={"i": 0})
+        self.assertEqual(setup.keys(), ["exp0"])
+
+    def test_read_many(self):
+        self.storage.write("exp1", "eval_acc", [{"scores": [1]}])
+
+        self.assertEqual(
+            self.storage.read_many(self.storage.keys(), "meta"),
+            {f"exp{i}": {"i": i} for i in range(3)},
+        )
+        self.assertEqual(
+            self.storage.read_many(self.storage.keys(), "eval_acc"),
+            {"exp1": [{"scores": [1]}]},
+        )
+        self.assertEqual(
+            self.storage.read_many(["exp0", "missing"], "meta"), {"exp0": {"i": 0}}
+        )
+
+        # errors other than a missing experiment or field are not hidden.
+        with mock.patch.object(self.storage, "read", side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                self.storage.read_many(["exp0"], "meta")
+        with mock.patch.object(self.storage, "read", side_effect=FileNotFoundError):
+            with self.assertRaises(FileNotFoundError):
+                self.storage.read_many(["exp0"], "meta")
+
+    def test_missing_meta(self):
+        self.storage.create("exp3")
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            setup = ExpSetup(self.storage)
+
+        self.assertEqual(sorted(setup.keys()), ["exp0", "exp1", "exp2"])
+        self.assertIn("Missing data for  exp3", out.getvalue())
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestMongoStorage(unittest.TestCase):
+
+    def setUp(self):
+        start_mongomock(self)
+
+        self.storage = MongoStorage(MONGO_URI, "rw")
+        self.storage.create("exp1")
+        self.storage.write("exp1", "meta", {"name": "test1"})
+
+    def test_catalog(self):
+        storage = self.storage
+        storage.create("exp2")
+        storage.write("exp2", "meta", {"name": "test2", "dataset": "d"})
+
+        # the first meta write built the catalog; later ones keep it current.
+        self.assertEqual(storage.catalog.count_documents({}), 2)
+        self.assertIn(
+            "meta.dataset_1", storage.catalog.index_information()
+        )
+        storage.write_subfield("exp1", "meta", "dataset", "d")
+        self.assertEqual(
+            storage.find({"dataset": "d"}),
+            {
+                "exp1": {"name": "test1", "dataset": "d"},
+                "exp2": {"name": "test2", "dataset": "d"},
+            },
+        )
+        self.assertEqual(list(storage.find({"name": "exp2"})), ["exp2"])
+
+        # experiments created or dropped behind the catalog's back.
+        storage.db["exp3"].insert_one(
+            {"_id": "exp3", LAYOUT_KEY: NATIVE, "meta": {"dataset": "d"}}
+        )
+        storage.db.drop_collection("exp2")
+        self.assertEqual(sorted(storage.find({"dataset": "d"})), ["exp1", "exp2"])
+        self.assertEqual(storage.reconcile(), 2)
+        self.assertEqual(sorted(storage.find({"dataset": "d"})), ["exp1", "exp3"])
+        self.assertEqual(storage.catalog.count_documents({}), 2)
+
+        # find is a single catalog query.
+        with mock.patch.object(storage, "keys") as keys:
+            storage.find({"dataset": "d"})
+        keys.assert_not_called()
+
+        # metas rewritten without the catalog need a rebuild.
+        storage.db["exp3"].update_one({}, {"$set": {"meta": {"dataset": "e"}}})
+        self.assertEqual(storage.build_catalog(), 2)
+        self.assertEqual(list(storage.find({"dataset": "e"})), ["exp3"])
+
+        setup = ExpSetup(storage, criteria={"dataset": "e"})
+        self.assertEqual(setup.keys(), ["exp3"])
+
+    def test_read_many(self):
+        storage = self.storage
+        for i in range(2, 6):
+            storage.create(f"exp{i}")
+            storage.write(f"exp{i}", "meta", {"name": f"test{i}"})
+        storage.write("exp3", "data", [{"i": 0}, {"i": 1}])
+
+        # several union aggregations of two collections each.
+        with mock.patch.object(
+            storage, "_union_find", partial(storage._union_find, chunk_size=2)
+        ):
+            self.assertEqual(
+                storage.read_many(storage.keys(), "meta"),
+                {f"exp{i}": {"name": f"test{i}"} for i in range(1, 6)},
+            )
+            self.assertEqual(
+                storage.read_many(storage.keys(), "data"), {"exp3": [{"i": 0}, {"i": 1}]}
+            )
+            self.assertEqual(
+                storage.get_many(["exp3"]),
+                {"exp3": {"_id": "exp3", "meta": {"name": "test3"}, "data": [{"i": 0}, {"i": 1}]}},
+            )
+
+        # a missing experiment is a KeyError, which the generic read_many skips.
+        with self.assertRaises(KeyError):
+            storage.read("missing", "meta")
+        self.assertEqual(
+            Storage.read_many(storage, ["exp2", "missing"], "meta"),
+            {"exp2": {"name": "test2"}},
+        )
+
+    def test_collection_cache(self):
+        storage = self.storage
+        other = MongoStorage(MONGO_URI, "rw")
+
+        # known names are answered without listing collections.
+        with mock.patch.object(
+            storage.db, "list_collection_names", side_effect=AssertionError
+        ):
+            self.assertTrue(storage.exists("exp1"))
+
+        other.create("exp2")
+        self.assertTrue(storage.exists("exp2"))
+
+        # drops by another process are seen once the cache is invalidated.
+        other.delete("exp1")
+        self.assertTrue(storage.exists("exp1"))
+        storage.invalidate("exp1")
+        self.assertFalse(storage.exists("exp1"))
+
+        other.delete("exp2")
+        storage.invalidate()
+        self.assertFalse(storage.exists("exp2"))
+        self.assertEqual(storage.keys(), [])
+
+    def test_push_elements(self):
+        storage = self.storage
+        storage.write("exp1", "data", [{"i": i} for i in range(5)], batch_size=2)
+        storage.extend_subfield("exp1", "data", [{"i": 5}, {"i": 6}])
+        self.assertEqual(storage.read("exp1", "data"), [{"i": i} for i in range(7)])
+        self.assertEqual(storage.count("exp1", "data"), 7)
+
+        # a rewrite replaces the whole list.
+        storage.write("exp1", "data", [{"i": 0}])
+        self.assertEqual(storage.read("exp1", "data"), [{"i": 0}])
+
+    def test_bulk_write_size(self):
+        storage = self.storage
+        data = [{"i": i, "text": "x" * 100} for i in range(10)]
+        bulk_write = mongomock.collection.Collection.bulk_write
+        requests = []
+
+        def record(collection, batch, **kwargs):
+            requests.extend(batch)
+            return bulk_write(collection, batch, **kwargs)
+
+        # updates are split by encoded size as well as by element count.
+        with mock.patch("expkit.storage.mongo.MAX_UPDATE_BYTES", 300), mock.patch.object(
+            mongomock.collection.Collection, "bulk_write", record
+        ):
+            storage.write("exp1", "data", data, batch_size=4)
+            self.assertEqual(
+                [len(r._doc["$push"]["data"]["$each"]) for r in requests[1:]],
+                [2, 2, 2, 2, 2],
+            )
+
+            storage.db["old"].insert_one({"_id": "old"})
+            storage.extend_subfield("old", "data", data)
+            self.assertEqual(storage.read("old", "data"), data)
+
+        self.assertEqual(storage.read("exp1", "data"), data)
+
+    def test_upgrade_layout(self):
+        storage = self.storage
+        data = [{"input": i, "outputs": [i, i + 1]} for i in range(3)]
+
+        # a document written before native arrays.
+        storage.db["old"].insert_one(
+            {"_id": "old", "meta": {"name": "old"}, "data": encode_mongo_format(data)}
+        )
+        self.assertEqual(storage.read("old", "data"), data)
+        self.assertEqual(storage.read_subfield("old", "data", ">>1"), data[1])
+
+        # decoding leaves the fetched document as it was.
+        document = storage.db["old"].find_one()
+        self.assertEqual(storage._decode(document)["data"], data)
+        self.assertEqual(document["data"], encode_mongo_format(data))
+
+        self.assertEqual(storage.upgrade_layout(), 1)
+        self.assertEqual(storage.upgrade_layout(), 0)
+        self.assertEqual(storage.db["old"].find_one()["data"], data)
+
+        self.assertEqual(storage.read("old", "data"), data)
+        self.assertEqual(storage.read_subfield("old", "data", ">>1"), data[1])
+        storage.append_subfield("old", "data", {"input": 3})
+        self.assertEqual(storage.count("old", "data"), 4)
+        self.assertEqual(storage.get("old")["meta"], {"name": "old"})
+
+        document = storage.db["old"].find_one()
+        self.assertNotIn(LAYOUT_KEY, storage._decode(document))
+        self.assertEqual(document[LAYOUT_KEY], NATIVE)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestMongoInstanceStorage(unittest.TestCase):
+
+    def setUp(self):
+        start_mongomock(self)
+
+        self.storage = MongoInstanceStorage(MONGO_URI, "rw", batch_size=2)
+        self.storage.create("exp1")
+        self.storage.write("exp1", "meta", {"name": "test1"})
+        self.storage.write("exp1", "data", [{"i": i} for i in range(5)])
+
+    def test_read_write(self):
+        storage = self.storage
+        self.assertEqual(sorted(storage.fields("exp1")), ["data", "meta"])
+        self.assertTrue(storage.is_list("exp1", "data"))
+        self.assertFalse(storage.is_list("exp1", "meta"))
+        self.assertEqual(storage.count("exp1", "data"), 5)
+        self.assertEqual(
+            storage.get("exp1"),
+            {"_id": "exp1", "meta": {"name": "test1"}, "data": [{"i": i} for i in range(5)]},
+        )
+        self.assertEqual(
+            list(storage.iterable("exp1", "data", where={"i": 3})), [{"i": 3}]
+        )
+        self.assertEqual(storage.read_subfield("exp1", "data", ">>4"), {"i": 4})
+        self.assertEqual(storage.find({"name": "exp1"}), {"exp1": {"name": "test1"}})
+
+        storage.write_subfield("exp1", "data", ">>5", {"i": 5})
+        storage.append_subfield("exp1", "data", {"i": 6})
+        self.assertEqual(storage.read("exp1", "data"), [{"i": i} for i in range(7)])
+
+        # a list rewritten as a value and back.
+        storage.write("exp1", "data", {"i": 0})
+        self.assertEqual(storage.read("exp1", "data"), {"i": 0})
+        with self.assertRaises(ValueError):
+            storage.append_subfield("exp1", "data", {"i": 1})
+
+        storage.write("exp1", "data", [{"i": 1}])
+        self.assertEqual(storage.read("exp1", "data"), [{"i": 1}])
+        self.assertEqual(storage.elements.count_documents({}), 1)
+
+    def test_rewrite_is_atomic(self):
+        storage = self.storage
+        insert_elements = storage._insert_elements
+        seen = []
+
+        def insert_and_read(*args, **kwargs):
+            insert_elements(*args, **kwargs)
+            seen.append(storage.read("exp1", "data"))
+
+        # readers see the old list until the new one is complete.
+        with mock.patch.object(storage, "_insert_elements", insert_and_read):
+            storage.write("exp1", "data", [{"j": j} for j in range(3)])
+
+        self.assertEqual(seen, [[{"i": i} for i in range(5)]])
+        self.assertEqual(storage.read("exp1", "data"), [{"j": j} for j in range(3)])
+
+    def test_concurrent_extend(self):
+        storage = self.storage
+        other = MongoInstanceStorage(MONGO_URI, "rw")
+        insert_elements = storage._insert_elements
+
+        def interleaved(*args, **kwargs):
+            # another writer appends between this reservation and its insert.
+            other.extend_subfield("exp1", "data", [{"i": "other"}])
+            insert_elements(*args, **kwargs)
+
+        with mock.patch.object(storage, "_insert_elements", interleaved):
+            storage.extend_subfield("exp1", "data", [{"i": 5}, {"i": 6}])
+
+        self.assertEqual(
+            storage.read("exp1", "data"),
+            [{"i": i} for i in range(7)] + [{"i": "other"}],
+        )
+
+if __name__ == "__main__":
+    unittest.main()